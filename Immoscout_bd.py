@@ -1,123 +1,25 @@
-﻿import psycopg2
-import requests
+﻿import requests
 import time
 from datetime import datetime, timezone
 from zoneinfo import ZoneInfo
-from config import DB_CONFIG, IMMOSCOUT_CLIENT_ID, IMMOSCOUT_CLIENT_SECRET, IMMOSCOUT_HEADERS
+from config import IMMOSCOUT_CLIENT_ID, IMMOSCOUT_CLIENT_SECRET, IMMOSCOUT_HEADERS
+from geocoding import geocode_address
+from scraper_core import ListingWriter, clean_price_size, known_ids
 
 BERLIN_TZ = ZoneInfo("Europe/Berlin")
 
 
-def init_db():
-    conn = psycopg2.connect(**DB_CONFIG)
-    cursor = conn.cursor()
-    # Создание таблицы listings, если не существует
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS listings (
-            id TEXT PRIMARY KEY,
-            url TEXT,
-            price REAL,
-            price_warm REAL,
-            size REAL,
-            address TEXT,
-            lat REAL,
-            lon REAL,
-            swapflat INTEGER,
-            wbs_required INTEGER,
-            created_at TEXT,
-            source_immoscout INTEGER,
-            source_kleinanzeigen INTEGER,
-            source_immowelt INTEGER,
-            photo_url TEXT,
-            is_active TEXT,
-            last_checked TEXT,
-            source_wggesucht INTEGER,
-            source_inberlinwohnen INTEGER
-        )
-    """)
-    conn.commit()
-    return conn, cursor
-
-
-def was_seen(cursor, obj_id):
-    cursor.execute("SELECT 1 FROM listings WHERE id = %s", (obj_id,))
-    return cursor.fetchone() is not None
-
-
-def mark_as_seen(conn, cursor, obj_id, listing):
-    cursor.execute("""
-        INSERT INTO listings (
-            id, url, price, price_warm, size, address, lat, lon, swapflat,
-            wbs_required, created_at, source_immoscout, source_kleinanzeigen,
-            source_immowelt, photo_url, is_active, last_checked,
-            source_wggesucht, source_inberlinwohnen
-        ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-        ON CONFLICT (id) DO NOTHING
-    """, (
-        obj_id,
-        listing["url"],
-        listing["price"],
-        listing["price_warm"],
-        listing["size"],
-        listing["address"],
-        listing["lat"],
-        listing["lon"],
-        int(listing["swapflat"]),
-        int(listing["wbs_required"]),
-        datetime.now(BERLIN_TZ).isoformat(timespec="seconds"),
-        1, 0, 0,  # source_immoscout, source_kleinanzeigen, source_immowelt
-        listing["photo_url"],
-        "1",
-        datetime.now(BERLIN_TZ).isoformat(timespec="seconds"),
-        0, 0  # source_wggesucht, source_inberlinwohnen
-    ))
-    conn.commit()
-
-
-def clean_price_size(value):
-    if not value:
-        return None
-    val = value.replace("\xa0", "").replace("€", "").replace("m²", "").strip()
-    if val.count(",") > 1:
-        return None
-    if "," in val:
-        last_dot = val.rfind(".")
-        comma_pos = val.find(",")
-        if last_dot != -1 and comma_pos < last_dot:
-            return None
-    val = val.replace(".", "").replace(",", ".")
-    try:
-        return float(val)
-    except ValueError:
-        return None
-
-
-def geocode_address(address):
-    try:
-        url = "https://nominatim.openstreetmap.org/search"
-        params = {"q": address, "format": "json", "addressdetails": 1, "limit": 1}
-        headers = {"User-Agent": "Mozilla/5.0 (compatible; ImmoScoutBot/1.0)"}
-        response = requests.get(url, params=params, headers=headers, timeout=10)
-        response.raise_for_status()
-        data = response.json()
-        if data:
-            return float(data[0]["lat"]), float(data[0]["lon"])
-    except:
-        pass
-    return None, None
-
-
 def extract_warmmiete(data):
     for section in data.get("sections", []):
         if section.get("type") == "TOP_ATTRIBUTES":
             for attr in section.get("attributes", []):
                 if attr.get("label", "").lower().startswith("warmmiete"):
-                    return clean_price_size(attr.get("text"))
+                    return clean_price_size(attr.get("text"), strict=True)
     for section in data.get("sections", []):
         if section.get("type") == "ATTRIBUTE_LIST" and section.get("title", "").lower() == "kosten":
             for attr in section.get("attributes", []):
                 if attr.get("label", "").lower().startswith("gesamtmiete"):
-                    return clean_price_size(attr.get("text"))
+                    return clean_price_size(attr.get("text"), strict=True)
     return None
 
 
@@ -174,7 +76,7 @@ def get_new_ids(headers, published_after):
     return ids
 
 
-def get_expose_details(headers, ids, cursor, conn):
+def get_expose_details(headers, ids, writer):
     count = 0
     new_ids = ids
 
@@ -205,14 +107,13 @@ def get_expose_details(headers, ids, cursor, conn):
                 lat, lon = geocode_address(address)
                 if lat and lon:
                     print(f"🌍 Координаты найдены для адреса: '{address}'")
-                time.sleep(1)
 
             attr_section = next((s for s in data.get("sections", []) if s.get("type") == "TOP_ATTRIBUTES"), {})
             price_raw = next((a["text"] for a in attr_section.get("attributes", []) if "€" in a.get("text", "")), None)
             size_raw = next((a["text"] for a in attr_section.get("attributes", []) if "m²" in a.get("text", "")), None)
 
-            price = clean_price_size(price_raw)
-            size = clean_price_size(size_raw)
+            price = clean_price_size(price_raw, strict=True)
+            size = clean_price_size(size_raw, strict=True)
             price_warm = extract_warmmiete(data)
             swapflat = is_swapflat(data)
             wbs_required = is_wbs_required(data)
@@ -235,16 +136,15 @@ def get_expose_details(headers, ids, cursor, conn):
 
             count += 1
             print(f"{count}. 🏠 {log_listing}")
-            mark_as_seen(conn, cursor, obj_id, listing)
+            writer.add(obj_id, listing)
             time.sleep(0.3)
         except Exception as e:
             print(f"⚠️ Ошибка при обработке ID {obj_id}: {str(e)}")
 
-    return count > 0
+    return count
 
 
 def run():
-    conn, cursor = init_db()
     try:
         token = get_token()
         headers = {"Authorization": f"Bearer {token}", **IMMOSCOUT_HEADERS}
@@ -252,17 +152,24 @@ def run():
         published_after = datetime.now(timezone.utc).isoformat(timespec="seconds")
         ids = get_new_ids(headers, published_after)
 
+        # Экспозе запрашиваем только для id, которых ещё нет в базе
+        known = known_ids(ids)
+        ids = [obj_id for obj_id in ids if str(obj_id) not in known]
+        if known:
+            print(f"⏭ Уже в базе: {len(known)}, новых: {len(ids)}")
+
         if ids:
-            return get_expose_details(headers, ids, cursor, conn)
+            with ListingWriter("immoscout") as writer:
+                get_expose_details(headers, ids, writer)
+            return writer.inserted
         else:
             print("🔍 Новых объявлений пока нет.")
-            return False
+            return 0
 
     except Exception as e:
+        # Ошибка — не «нет новых»: main.collect_scrapers отправит её админу и отложит опрос
         print(f"🔥 Критическая ошибка: {str(e)}")
-        return False
-    finally:
-        conn.close()
+        raise
 
 
 if __name__ == "__main__":
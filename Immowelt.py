@@ -2,11 +2,11 @@
 import time
 import json
 import logging
-import psycopg2
-from datetime import datetime
 from urllib.parse import urlencode
 from zoneinfo import ZoneInfo
-from config import DB_CONFIG, PROXY, USER_AGENT
+from config import PROXY, USER_AGENT
+from geocoding import geocode_address
+from scraper_core import ListingWriter, clean_price_size, known_ids
 
 BERLIN_TZ = ZoneInfo("Europe/Berlin")
 
@@ -19,92 +19,6 @@ logging.basicConfig(
     ]
 )
 
-def init_db():
-    conn = psycopg2.connect(**DB_CONFIG)
-    cursor = conn.cursor()
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS listings (
-            id TEXT PRIMARY KEY,
-            url TEXT,
-            price REAL,
-            price_warm REAL,
-            size REAL,
-            address TEXT,
-            lat REAL,
-            lon REAL,
-            swapflat INTEGER,
-            wbs_required INTEGER,
-            created_at TEXT,
-            source_immoscout INTEGER,
-            source_kleinanzeigen INTEGER,
-            source_immowelt INTEGER,
-            photo_url TEXT,
-            is_active TEXT,
-            last_checked TEXT,
-            source_wggesucht INTEGER,
-            source_inberlinwohnen INTEGER
-        )
-    """)
-    conn.commit()
-    return conn, cursor
-
-def was_seen(cursor, obj_id):
-    cursor.execute("SELECT 1 FROM listings WHERE id = %s", (obj_id,))
-    return cursor.fetchone() is not None
-
-def mark_as_seen(conn, cursor, obj_id, listing):
-    cursor.execute("""
-        INSERT INTO listings (
-            id, url, price, price_warm, size, address, lat, lon, swapflat,
-            wbs_required, created_at, source_immoscout, source_kleinanzeigen,
-            source_immowelt, photo_url, is_active, last_checked,
-            source_wggesucht, source_inberlinwohnen
-        ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-        ON CONFLICT (id) DO NOTHING
-    """, (
-        obj_id,
-        listing["url"],
-        listing["price"],
-        listing["price_warm"],
-        listing["size"],
-        listing["address"],
-        listing["lat"],
-        listing["lon"],
-        int(listing["swapflat"]),
-        int(listing["wbs_required"]),
-        datetime.now(BERLIN_TZ).isoformat(timespec="seconds"),
-        0, 0, 1,  # sources
-        listing["photo_url"],
-        "1",
-        datetime.now(BERLIN_TZ).isoformat(timespec="seconds"),
-        0, 0
-    ))
-    conn.commit()
-
-def clean_price_size(value):
-    if not value:
-        return None
-    val = value.replace("\xa0", "").replace("€", "").replace("m²", "").strip()
-    val = val.replace(".", "").replace(",", ".")
-    try:
-        return float(val)
-    except ValueError:
-        return None
-
-def geocode_address(address):
-    try:
-        url = "https://nominatim.openstreetmap.org/search"
-        params = {"q": address, "format": "json", "limit": 1}
-        headers = {"User-Agent": USER_AGENT}
-        r = requests.get(url, params=params, headers=headers, timeout=10)
-        r.raise_for_status()
-        data = r.json()
-        if data:
-            return float(data[0]["lat"]), float(data[0]["lon"])
-    except Exception:
-        pass
-    return None, None
-
 class ImmoweltScraper:
     def __init__(self):
         self.session = requests.Session()
@@ -175,10 +89,10 @@ class ImmoweltScraper:
         r = self.session.get(url, headers=headers)
         return r.json() if r.status_code == 200 else []
 
-    def parse_and_store_listing(self, listing, conn, cursor):
+    def parse_and_store_listing(self, listing, writer):
         obj_id = listing.get("id")
-        if not obj_id or was_seen(cursor, obj_id):
-            return
+        if not obj_id:
+            return False
 
         address_parts = listing.get("location", {}).get("address", {})
         address = ", ".join(filter(None, [
@@ -220,26 +134,29 @@ class ImmoweltScraper:
             "wbs_required": 0
         }
 
-        mark_as_seen(conn, cursor, obj_id, parsed)
+        writer.add(obj_id, parsed)
         logging.info(f"💾 Сохранено объявление: {obj_id}")
+        return True
 
     def scrape(self, max_pages=1):
         if not self.bypass_datadome():
-            return
-        conn, cursor = init_db()
-        for page in range(1, max_pages + 1):
-            result = self.search_listings(page=page)
-            if not result:
-                continue
-            ids = [item["id"] for item in result.get("classifieds", [])]
-            details = self.get_listing_details(ids)
-            for listing in details:
-                try:
-                    self.parse_and_store_listing(listing, conn, cursor)
-                except Exception as e:
-                    logging.warning(f"⚠️ Ошибка при обработке: {e}")
-            time.sleep(1.5)
-        conn.close()
+            return 0
+        with ListingWriter("immowelt") as writer:
+            for page in range(1, max_pages + 1):
+                result = self.search_listings(page=page)
+                if not result:
+                    continue
+                ids = [item["id"] for item in result.get("classifieds", [])]
+                # Детали и геокодирование — только для id, которых ещё нет в базе
+                known = known_ids(ids)
+                details = self.get_listing_details([obj_id for obj_id in ids if str(obj_id) not in known])
+                for listing in details:
+                    try:
+                        self.parse_and_store_listing(listing, writer)
+                    except Exception as e:
+                        logging.warning(f"⚠️ Ошибка при обработке: {e}")
+                time.sleep(1.5)
+        return writer.inserted
 
 if __name__ == "__main__":
     scraper = ImmoweltScraper()
@@ -247,5 +164,4 @@ if __name__ == "__main__":
 
 def run():
     scraper = ImmoweltScraper()
-    scraper.scrape(max_pages=1)
-    return True
+    return scraper.scrape(max_pages=1)
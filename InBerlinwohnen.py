@@ -1,106 +1,18 @@
 ﻿import requests
 import re
-import time
-import psycopg2
-from datetime import datetime
 from bs4 import BeautifulSoup
 from zoneinfo import ZoneInfo
-from config import DB_CONFIG  # ➤ содержит словарь подключения к PostgreSQL
+from geocoding import geocode_address
+from scraper_core import ListingWriter, clean_price_size, known_ids
 
 BERLIN_TZ = ZoneInfo("Europe/Berlin")
 BASE_URL = "https://inberlinwohnen.de/"
 
-def init_db():
-    conn = psycopg2.connect(**DB_CONFIG)
-    cursor = conn.cursor()
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS listings (
-            id TEXT PRIMARY KEY,
-            url TEXT,
-            price REAL,
-            price_warm REAL,
-            size REAL,
-            address TEXT,
-            lat REAL,
-            lon REAL,
-            swapflat INTEGER,
-            wbs_required INTEGER,
-            created_at TEXT,
-            source_immoscout INTEGER,
-            source_kleinanzeigen INTEGER,
-            source_immowelt INTEGER,
-            photo_url TEXT,
-            is_active TEXT,
-            last_checked TEXT,
-            source_wggesucht INTEGER,
-            source_inberlinwohnen INTEGER
-        )
-    """)
-    conn.commit()
-    return conn, cursor
-
-def mark_as_seen(conn, cursor, obj_id, listing):
-    cursor.execute("""
-        INSERT INTO listings (
-            id, url, price, price_warm, size, address, lat, lon, swapflat,
-            wbs_required, created_at, source_immoscout, source_kleinanzeigen,
-            source_immowelt, photo_url, is_active, last_checked,
-            source_wggesucht, source_inberlinwohnen
-        ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-        ON CONFLICT (id) DO NOTHING
-    """, (
-        obj_id,
-        listing["url"],
-        listing["price"],
-        None,
-        listing["size"],
-        listing["address"],
-        listing["lat"],
-        listing["lon"],
-        0,
-        int(listing["wbs_required"]),
-        datetime.now(BERLIN_TZ).isoformat(timespec="seconds"),
-        0, 0, 0,
-        listing["photo_url"],
-        "1",
-        datetime.now(BERLIN_TZ).isoformat(timespec="seconds"),
-        0,
-        1
-    ))
-    conn.commit()
-
-def geocode_address(address):
-    try:
-        url = "https://nominatim.openstreetmap.org/search"
-        params = {"q": address, "format": "json", "limit": 1}
-        headers = {"User-Agent": "Mozilla/5.0 (compatible; InBerlinBot/1.0)"}
-        response = requests.get(url, params=params, headers=headers, timeout=10)
-        response.raise_for_status()
-        data = response.json()
-        if data:
-            lat = float(data[0]["lat"])
-            lon = float(data[0]["lon"])
-            print(f"{lat}, {lon} ← {address}")
-            return lat, lon
-    except Exception:
-        pass
-    return None, None
-
-def clean_price_size(value):
-    if not value:
-        return None
-    val = value.replace("\xa0", "").replace("€", "").replace("m²", "").strip()
-    val = val.replace(".", "").replace(",", ".")
-    try:
-        return float(val)
-    except ValueError:
-        return None
-
 def is_wbs_required(text):
     text = text.lower()
     return "wbs" in text and "ohne" not in text or "wohnberechtigungsschein" in text
 
-def fetch_inberlin_listings(seen_ids):
+def fetch_inberlin_listings():
     url = "https://inberlinwohnen.de/wp-content/themes/ibw/skript/wohnungsfinder.php"
     headers = {
         "User-Agent": "Mozilla/5.0",
@@ -121,15 +33,14 @@ def fetch_inberlin_listings(seen_ids):
     soup = BeautifulSoup(html, "html.parser")
     flats = soup.select("li.tb-merkflat")
 
-    listings = []
+    # Проверяем в базе только id из этого ответа, а не загружаем все id listings
+    flat_ids = [flat.get("id", "").replace("flat_", "").strip() for flat in flats]
+    seen_ids = known_ids(flat_id for flat_id in flat_ids if flat_id)
 
-    for flat in flats:
-        raw_id = flat.get("id", "")
-        if not raw_id:
-            continue
+    listings = []
 
-        flat_id = raw_id.replace("flat_", "").strip()
-        if flat_id in seen_ids:
+    for flat, flat_id in zip(flats, flat_ids):
+        if not flat_id or flat_id in seen_ids:
             continue
 
         title_tag = flat.select_one("h3 span._tb_left")
@@ -169,30 +80,26 @@ def fetch_inberlin_listings(seen_ids):
     return listings
 
 def run():
-    conn, cursor = init_db()
     try:
-        cursor.execute("SELECT id FROM listings")
-        seen_ids = set(row[0] for row in cursor.fetchall())
-
-        listings = fetch_inberlin_listings(seen_ids)
-        added_count = 0
+        listings = fetch_inberlin_listings()
 
         for listing in listings:
-            print(f"{listing['id']} →", end=" ")
             lat, lon = geocode_address(listing["address"])
             listing["lat"] = lat
             listing["lon"] = lon
-            time.sleep(1)
+            print(f"{listing['id']} → {lat}, {lon} ← {listing['address']}")
 
-        for listing in listings:
-            mark_as_seen(conn, cursor, listing["id"], listing)
-            added_count += 1
+        with ListingWriter("inberlinwohnen") as writer:
+            for listing in listings:
+                writer.add(listing["id"], listing)
+        added_count = writer.inserted
 
         print(f"\n✅ Добавлено: {added_count}")
     except Exception as e:
+        # Ошибка — не «нет новых»: main.collect_scrapers отправит её админу и отложит опрос
         print(f"🔥 Ошибка выполнения: {str(e)}")
-    finally:
-        conn.close()
+        raise
+    return added_count
 
 if __name__ == "__main__":
     run()
@@ -1,92 +1,15 @@
 ﻿# -*- coding: utf-8 -*-
 import requests
-import psycopg2
 import re
 import datetime
 import time
 from bs4 import BeautifulSoup
 from zoneinfo import ZoneInfo
-from config import DB_CONFIG
+from geocoding import geocode_address
+from scraper_core import ListingWriter, known_ids
 
 BERLIN_TZ = ZoneInfo("Europe/Berlin")
 
-def init_db():
-    conn = psycopg2.connect(**DB_CONFIG)
-    cursor = conn.cursor()
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS listings (
-            id TEXT PRIMARY KEY,
-            url TEXT,
-            price REAL,
-            price_warm REAL,
-            size REAL,
-            address TEXT,
-            lat REAL,
-            lon REAL,
-            swapflat INTEGER,
-            wbs_required INTEGER,
-            created_at TEXT,
-            source_immoscout INTEGER,
-            source_kleinanzeigen INTEGER,
-            source_immowelt INTEGER,
-            photo_url TEXT,
-            is_active TEXT,
-            last_checked TEXT,
-            source_wggesucht INTEGER,
-            source_inberlinwohnen INTEGER
-        )
-    """)
-    conn.commit()
-    return conn, cursor
-
-def was_seen(cursor, obj_id):
-    cursor.execute("SELECT 1 FROM listings WHERE id = %s", (obj_id,))
-    return cursor.fetchone() is not None
-
-def mark_as_seen(conn, cursor, obj_id, listing):
-    now = datetime.datetime.now(BERLIN_TZ).isoformat(timespec="seconds")
-    cursor.execute("""
-        INSERT INTO listings (
-            id, url, price, price_warm, size, address, lat, lon, swapflat,
-            wbs_required, created_at, source_immoscout, source_kleinanzeigen,
-            source_immowelt, photo_url, is_active, last_checked,
-            source_wggesucht, source_inberlinwohnen
-        ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-        ON CONFLICT (id) DO NOTHING
-    """, (
-        obj_id,
-        listing["url"],
-        listing["price"],
-        listing["price_warm"],
-        listing["size"],
-        listing["address"],
-        listing["lat"],
-        listing["lon"],
-        int(listing["swapflat"]),
-        int(listing["wbs_required"]),
-        now,
-        0, 1, 0,
-        listing["photo_url"],
-        "1",
-        now,
-        0, 0
-    ))
-    conn.commit()
-
-def geocode_address(address):
-    try:
-        url = "https://nominatim.openstreetmap.org/search"
-        params = {"q": address, "format": "json", "addressdetails": 1, "limit": 1}
-        headers = {"User-Agent": "Mozilla/5.0 (compatible; KleinanzeigenBot/1.0)"}
-        response = requests.get(url, params=params, headers=headers, timeout=10)
-        response.raise_for_status()
-        data = response.json()
-        if data:
-            return float(data[0]["lat"]), float(data[0]["lon"])
-    except:
-        pass
-    return None, None
-
 def fetch_html(url):
     headers = {
         "User-Agent": "Mozilla/5.0 (compatible; KleinanzeigenBot/1.0)",
@@ -164,53 +87,50 @@ def extract_data(soup):
         if not obj_id:
             continue
 
-        lat, lon = geocode_address(address)
-
-        images = []
-        soup_detail = fetch_html(url)
-        if soup_detail:
-            all_imgs = soup_detail.find_all("img")
-            for img in all_imgs:
-                src = img.get("src") or ""
-                if src.startswith("https://img.kleinanzeigen.de/api/v1/prod-ads/images/"):
-                    images.append(src)
-                if len(images) >= 5:
-                    break
-
-            price_warm = extract_warmmiete_from_soup(soup_detail)
-        else:
-            price_warm = None
-
-        photo_url = ",".join(images)
-
+        # Координаты, фото и Warmmiete — в enrich_entry, только для новых объявлений
         entry = {
             'id': str(obj_id),
-            'image': images[0] if images else None,
             'url': url,
             'title': title_elem.text.strip(),
             'price': price,
-            'price_warm': price_warm,
             'size': size,
             'address': address,
-            'lat': lat,
-            'lon': lon,
             'swapflat': 'tausch' in title_elem.text.lower(),
-            'wbs_required': False,
-            'photo_url': photo_url
+            'wbs_required': False
         }
         entries.append(entry)
 
     return entries
 
+def enrich_entry(entry):
+    entry['lat'], entry['lon'] = geocode_address(entry['address'])
+
+    images = []
+    soup_detail = fetch_html(entry['url'])
+    if soup_detail:
+        all_imgs = soup_detail.find_all("img")
+        for img in all_imgs:
+            src = img.get("src") or ""
+            if src.startswith("https://img.kleinanzeigen.de/api/v1/prod-ads/images/"):
+                images.append(src)
+            if len(images) >= 5:
+                break
+
+        entry['price_warm'] = extract_warmmiete_from_soup(soup_detail)
+    else:
+        entry['price_warm'] = None
+
+    entry['image'] = images[0] if images else None
+    entry['photo_url'] = ",".join(images)
+    return entry
+
 def run(url=None):
-    conn, cursor = init_db()
     try:
         url = url or "https://www.kleinanzeigen.de/s-wohnung-mieten/berlin/c203+wohnung_mieten.swap_s:nein"
         soup = fetch_html(url)
 
         if soup is None:
-            print("❌ Не удалось получить HTML — пропуск.")
-            return False
+            raise RuntimeError(f"Не удалось получить HTML: {url}")
 
         entries = extract_data(soup)
 
@@ -218,32 +138,28 @@ def run(url=None):
         print(f"\n📌 Поиск новых объявлений после {now}...")
 
         if not entries:
-            print("⚠️ Не удалось получить объявления (возможно, структура страницы изменилась).")
-            return False
-
-        new_entries = 0
-        ids = [entry['id'] for entry in entries if not was_seen(cursor, entry['id'])]
-        print(f"✅ Найдено {len(ids)} новых объектов: {ids}")
-
-        for entry in entries:
-            if was_seen(cursor, entry['id']):
-                continue
-            new_entries += 1
-            print(f"{new_entries}. 🏠 {entry['address']} | {entry['price']}€ | {entry['size']} m² | Warmmiete: {entry.get('price_warm')}")
-            print(f"   🔗 {entry['url']}")
-            mark_as_seen(conn, cursor, entry['id'], entry)
-
-        if new_entries == 0:
+            raise RuntimeError("Не удалось получить объявления (возможно, структура страницы изменилась)")
+
+        known = known_ids(entry['id'] for entry in entries)
+        new_entries = [entry for entry in entries if entry['id'] not in known]
+        print(f"✅ Найдено {len(new_entries)} новых объектов: {[entry['id'] for entry in new_entries]}")
+
+        with ListingWriter("kleinanzeigen") as writer:
+            for number, entry in enumerate(new_entries, 1):
+                enrich_entry(entry)
+                print(f"{number}. 🏠 {entry['address']} | {entry['price']}€ | {entry['size']} m² | Warmmiete: {entry.get('price_warm')}")
+                print(f"   🔗 {entry['url']}")
+                writer.add(entry['id'], entry)
+
+        if writer.inserted == 0:
             print("📬 Новых объявлений не найдено.")
 
-        return new_entries > 0
+        return writer.inserted
 
     except Exception as e:
+        # Ошибка — не «нет новых»: main.collect_scrapers отправит её админу и отложит опрос
         print(f"🔥 Критическая ошибка в run_kleinanzeigen(): {e}")
-        return False
-
-    finally:
-        conn.close()
+        raise
 
 if __name__ == "__main__":
     run()
@@ -39,6 +39,7 @@ async def start(message: Message):
         "/export_users — 📄 выгрузить таблицу users\n"
         "/export_listings — 🏘 выгрузить таблицу listings\n"
         "/set_sub ID YYYY-MM-DD — 🛠 выдать подписку вручную\n"
+        "/digest ID on|off — 📰 объединять пачки объявлений в одно сообщение\n"
         "/stats — 📊 показать статистику подписок и поисков"
     )
 
@@ -75,6 +76,23 @@ async def set_subscription(message: Message):
     except Exception as e:
         await message.answer(f"❌ Ошибка: {e}\nФормат: /set_sub user_id YYYY-MM-DD")
 
+@router.message(Command("digest"))
+async def set_digest(message: Message):
+    if not is_admin(message.from_user.id):
+        return
+    try:
+        _, user_id, mode = message.text.strip().split()
+        if mode not in ("on", "off"):
+            raise ValueError("режим должен быть on или off")
+        conn = psycopg2.connect(**DB_CONFIG)
+        cursor = conn.cursor()
+        cursor.execute("UPDATE users SET digest_mode = %s WHERE id = %s", (1 if mode == "on" else 0, user_id))
+        conn.commit()
+        conn.close()
+        await message.answer(f"✅ Дайджест для <b>{user_id}</b>: <b>{mode}</b>")
+    except Exception as e:
+        await message.answer(f"❌ Ошибка: {e}\nФормат: /digest user_id on|off")
+
 @router.message(Command("stats"))
 async def show_stats(message: Message):
     if not is_admin(message.from_user.id):
@@ -178,6 +178,7 @@ def run():
 
             if not is_active:
                 cursor.execute("DELETE FROM listings WHERE id = %s", (row_dict['id'],))
+                cursor.execute("DELETE FROM listing_photo_cache WHERE listing_id = %s", (row_dict['id'],))
             else:
                 cursor.execute("""
                     UPDATE listings SET is_active = TRUE, last_checked = %s
@@ -0,0 +1,213 @@
+import asyncio
+import itertools
+import time
+
+import aiohttp
+
+from config import BOT_TOKEN
+
+TELEGRAM_API_BASE = "https://api.telegram.org"
+
+# Лимиты Bot API: ~30 сообщений/с всего, 1/с в личный чат, 20/мин в группу
+GLOBAL_RATE = 30
+PER_CHAT_RATE = 1
+GROUP_RATE = 20 / 60
+MAX_CONCURRENCY = 30
+MAX_ATTEMPTS = 4
+REQUEST_TIMEOUT = 30
+IDLE_BUCKET_TTL = 300  # сек: бакеты неактивных чатов удаляются
+
+
+class TokenBucket:
+    # Ожидающие обслуживаются строго по очереди (FIFO): токены копит только первый в очереди,
+    # поэтому альбом не обгоняют одиночные сообщения, а порядок постановки задаёт порядок отправки.
+    # asyncio.Lock привязан к циклу событий, поэтому создаётся заново для каждого asyncio.run().
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.lock = None
+        self.lock_loop = None
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def queue(self):
+        # Очередь ожидающих этого бакета; держать её можно дольше, чем длится take()
+        loop = asyncio.get_running_loop()
+        if self.lock_loop is not loop:
+            self.lock, self.lock_loop = asyncio.Lock(), loop
+        return self.lock
+
+    async def take(self, cost=1):
+        # Вызывать, держа queue()
+        cost = min(cost, self.capacity)
+        while True:
+            now = time.monotonic()
+            if now < self.blocked_until:
+                await asyncio.sleep(self.blocked_until - now)
+                continue
+            self._refill(now)
+            if self.tokens >= cost:
+                self.tokens -= cost
+                return
+            await asyncio.sleep((cost - self.tokens) / self.rate)
+
+    async def acquire(self, cost=1):
+        async with self.queue():
+            await self.take(cost)
+
+    def restart_refill(self):
+        # Токены, которые накопились бы за время ожидания после take(), не начисляются:
+        # интервал отсчитывается от фактической отправки
+        self.updated = time.monotonic()
+
+    def block(self, seconds):
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+    def is_idle(self, now):
+        return now - self.updated > IDLE_BUCKET_TTL and now >= self.blocked_until
+
+
+class DeliveryJob:
+    # ready — необязательная корутина ready(job): движок дожидается её перед отправкой,
+    # она же может пересобрать method/payload (например, подставить загруженные file_id)
+    __slots__ = ("chat_id", "method", "payload", "context", "ready")
+
+    def __init__(self, chat_id, method, payload, context=None, ready=None):
+        self.chat_id = chat_id
+        self.method = method
+        self.payload = payload
+        self.context = context
+        self.ready = ready
+
+    @property
+    def cost(self):
+        # Альбом расходует глобальный лимит как несколько сообщений
+        return len(self.payload.get("media", ())) or 1
+
+
+def interleave_by_chat(jobs):
+    # Круговой порядок: по одному заданию каждого чата, затем по второму и т.д.
+    # Внутри чата порядок сохраняется, чаты идут в порядке первого появления в списке.
+    # Глобальный бакет обслуживает ожидающих строго по очереди (TokenBucket.queue), а в эту очередь
+    # задание встаёт, получив токен своего чата, — поэтому среди готовых чатов порядок списка
+    # и есть порядок отправки: пользователь с огромной зоной не вытесняет остальных.
+    queues = {}
+    for job in jobs:
+        queues.setdefault(job.chat_id, []).append(job)
+    return [job for round_jobs in itertools.zip_longest(*queues.values())
+            for job in round_jobs if job is not None]
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def latency_report(samples):
+    # samples: {chat_id: [сек от появления объявления до доставки]}
+    if not samples:
+        return "нет доставок"
+    everything = [s for values in samples.values() for s in values]
+    per_chat_p95 = {chat_id: percentile(values, 0.95) for chat_id, values in samples.items()}
+    worst_chat = max(per_chat_p95, key=per_chat_p95.get)
+    return (f"p50 {percentile(everything, 0.5):.1f} сек, p95 {percentile(everything, 0.95):.1f} сек; "
+            f"по {len(samples)} польз.: медиана p50 {percentile([percentile(v, 0.5) for v in samples.values()], 0.5):.1f} сек, "
+            f"медиана p95 {percentile(list(per_chat_p95.values()), 0.5):.1f} сек, "
+            f"худший p95 {per_chat_p95[worst_chat]:.1f} сек ({worst_chat})")
+
+
+class DeliveryEngine:
+    def __init__(self, token=BOT_TOKEN, api_base=TELEGRAM_API_BASE,
+                 global_rate=GLOBAL_RATE, concurrency=MAX_CONCURRENCY):
+        self.base_url = f"{api_base}/bot{token}"
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_buckets = {}
+        self.concurrency = concurrency
+
+    def _chat_bucket(self, chat_id):
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            # Отрицательный chat_id — группа или канал
+            rate = GROUP_RATE if int(chat_id) < 0 else PER_CHAT_RATE
+            bucket = self.chat_buckets[chat_id] = TokenBucket(rate, 1)
+        return bucket
+
+    def _prune_buckets(self):
+        now = time.monotonic()
+        for chat_id in [c for c, b in self.chat_buckets.items() if b.is_idle(now)]:
+            del self.chat_buckets[chat_id]
+
+    async def _send(self, session, semaphore, job):
+        chat_bucket = self._chat_bucket(job.chat_id)
+        data = None
+        for attempt in range(1, MAX_ATTEMPTS + 1):
+            # Следующее сообщение в этот чат не начнёт ждать токен, пока это не получит общий токен,
+            # иначе оба ушли бы подряд, как только подойдёт их очередь в общем лимите
+            async with chat_bucket.queue():
+                await chat_bucket.take()
+                await self.global_bucket.acquire(job.cost)
+                chat_bucket.restart_refill()
+            try:
+                async with semaphore, session.post(f"{self.base_url}/{job.method}",
+                                                   json={"chat_id": job.chat_id, **job.payload}) as response:
+                    status = response.status
+                    data = await response.json(content_type=None)
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+                status, data = None, {"description": str(e)}
+                if attempt < MAX_ATTEMPTS:
+                    await asyncio.sleep(attempt)
+                continue
+
+            if status == 429:
+                retry_after = (data or {}).get("parameters", {}).get("retry_after", 1)
+                print(f"[DELIVERY] 429 для {job.chat_id}, ждём {retry_after} сек")
+                chat_bucket.block(retry_after)
+                continue
+            if status is not None and status >= 500 and attempt < MAX_ATTEMPTS:
+                await asyncio.sleep(attempt)
+                continue
+            return status, data
+        return status, data
+
+    async def run(self, jobs, on_result, on_tick=None, tick_interval=1.0):
+        # on_result(job, status, data) вызывается сразу по завершении каждой отправки,
+        # on_tick() — раз в tick_interval секунд, пока идёт рассылка
+        semaphore = asyncio.Semaphore(self.concurrency)
+        timeout = aiohttp.ClientTimeout(total=REQUEST_TIMEOUT)
+        connector = aiohttp.TCPConnector(limit=self.concurrency)
+
+        async with aiohttp.ClientSession(timeout=timeout, connector=connector) as session:
+            async def worker(job):
+                try:
+                    if job.ready is not None:
+                        await job.ready(job)
+                except Exception as e:
+                    status, data = None, {"description": f"ready: {e}"}
+                else:
+                    status, data = await self._send(session, semaphore, job)
+                try:
+                    on_result(job, status, data)
+                except Exception as e:
+                    print(f"[DELIVERY ERROR] Обработка результата для {job.chat_id}: {e}")
+
+            async def ticker():
+                while True:
+                    await asyncio.sleep(tick_interval)
+                    on_tick()
+
+            tick_task = asyncio.create_task(ticker()) if on_tick else None
+            try:
+                await asyncio.gather(*(worker(job) for job in jobs))
+            finally:
+                if tick_task:
+                    tick_task.cancel()
+        self._prune_buckets()
+
+    def deliver(self, jobs, on_result, on_tick=None):
+        if jobs:
+            asyncio.run(self.run(jobs, on_result, on_tick))
@@ -0,0 +1,178 @@
+import csv
+import difflib
+import os
+import re
+import sys
+import tempfile
+import threading
+from array import array
+from collections import defaultdict
+
+# Локальный геокодер Берлина: улица+PLZ → центроид, PLZ → центроид. Файл строится один раз
+# и лежит рядом с кодом: "python gazetteer.py fetch" выгружает адресные точки Берлина
+# (addr:street/addr:postcode) из OSM через Overpass API и собирает из них газеттир;
+# "python gazetteer.py build <адреса.csv>" — то же из уже скачанной выгрузки.
+# Развёртывание: выполнить "python gazetteer.py fetch" до первого запуска main.py (и обновлять
+# раз в несколько месяцев) — без файла main.py не стартует (require_gazetteer), иначе каждый
+# адрес ушёл бы в Nominatim. Данные © участники OpenStreetMap, лицензия ODbL:
+# при распространении файла нужна ссылка на https://www.openstreetmap.org/copyright.
+GAZETTEER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "berlin_gazetteer.csv")
+OVERPASS_URL = "https://overpass-api.de/api/interpreter"
+# Дома — точки или контуры зданий; для контуров "out center" даёт центр. Разделитель — табуляция:
+# запятые встречаются в названиях улиц, а CSV Overpass значения не экранирует
+OVERPASS_QUERY = """
+[out:csv("addr:street", "addr:postcode", ::lat, ::lon; true; "\\t")][timeout:900];
+area["boundary"="administrative"]["admin_level"="4"]["name"="Berlin"]->.berlin;
+nwr(area.berlin)["addr:street"]["addr:postcode"];
+out center;
+"""
+FUZZY_CUTOFF = 0.88  # difflib ratio для опечаток и вариантов написания внутри одного PLZ
+
+PLZ_RE = re.compile(r"\b(1[0-4]\d{3})\b")
+HOUSE_NUMBER_RE = re.compile(r"\s+\d+\s*[a-z]?(\s*[-/]\s*\d+\s*[a-z]?)?$")
+STREET_SUFFIXES = (
+    (re.compile(r"(strasse|str)$"), "str"),
+    (re.compile(r"(platz|pl)$"), "pl"),
+    (re.compile(r"(allee)$"), "allee"),
+)
+UMLAUTS = str.maketrans({"ä": "ae", "ö": "oe", "ü": "ue", "ß": "ss", "é": "e"})
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def normalize_street(street):
+    # "Karl-Marx-Straße", "Karl Marx Str." и "karl-marx-strasse" → "karlmarxstr"
+    key = HOUSE_NUMBER_RE.sub("", (street or "").lower().strip())
+    key = re.sub(r"[^a-z0-9]", "", key.translate(UMLAUTS))
+    for pattern, suffix in STREET_SUFFIXES:
+        key = pattern.sub(suffix, key)
+    return key
+
+
+def split_address(address):
+    # → (ключ улицы или "", PLZ или None); улица — первая часть до запятой, если это не PLZ/район
+    address = (address or "").replace("\xa0", " ")
+    plz_match = PLZ_RE.search(address)
+    plz = plz_match.group(1) if plz_match else None
+    first = address.split(",")[0].strip()
+    if plz and first.startswith(plz):
+        first = ""
+    return normalize_street(first), plz
+
+
+class Gazetteer:
+    # Компактно: координаты в array('f'), словари хранят только индекс строки
+    def __init__(self, path=GAZETTEER_PATH):
+        self.lat = array("f")
+        self.lon = array("f")
+        self.streets = defaultdict(dict)  # plz → {ключ улицы: индекс}
+        self.plz = {}                     # plz → индекс центроида
+        if not os.path.exists(path):
+            print(f"⚠️ Газеттир не найден ({path}) — геокодирование через кеш и Nominatim")
+            return
+        with open(path, encoding="utf-8", newline="") as f:
+            for row in csv.DictReader(f):
+                pos = len(self.lat)
+                self.lat.append(float(row["lat"]))
+                self.lon.append(float(row["lon"]))
+                if row["street"]:
+                    self.streets[row["plz"]][row["street"]] = pos
+                else:
+                    self.plz[row["plz"]] = pos
+        print(f"🗺 Газеттир: {sum(len(s) for s in self.streets.values())} улиц, {len(self.plz)} PLZ")
+
+    def _coords(self, pos):
+        return round(self.lat[pos], 6), round(self.lon[pos], 6)
+
+    def lookup_street(self, street, plz):
+        streets = self.streets.get(plz)
+        if not street or not streets:
+            return None
+        pos = streets.get(street)
+        if pos is None:
+            close = difflib.get_close_matches(street, streets.keys(), n=1, cutoff=FUZZY_CUTOFF)
+            if not close:
+                return None
+            pos = streets[close[0]]
+        return self._coords(pos)
+
+    def lookup_plz(self, plz):
+        pos = self.plz.get(plz)
+        return self._coords(pos) if pos is not None else None
+
+
+def require_gazetteer(path=GAZETTEER_PATH):
+    # Проверка при старте бота: отсутствие файла — ошибка развёртывания, а не тихий откат на Nominatim
+    if not os.path.exists(path):
+        raise SystemExit(f"❌ Газеттир не найден: {path}\n"
+                         f"   Соберите его перед запуском: python gazetteer.py fetch")
+
+
+def get_gazetteer():
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = Gazetteer()
+    return _index
+
+
+def build(source_path, target_path=GAZETTEER_PATH):
+    # source: CSV адресных точек с колонками street, postcode, lat, lon (один дом — одна строка)
+    sums = defaultdict(lambda: [0.0, 0.0, 0])
+    with open(source_path, encoding="utf-8", newline="") as f:
+        for row in csv.DictReader(f):
+            plz = (row.get("postcode") or "").strip()
+            if not PLZ_RE.fullmatch(plz):
+                continue
+            try:
+                lat, lon = float(row["lat"]), float(row["lon"])
+            except (TypeError, ValueError):
+                continue
+            street = normalize_street(row.get("street"))
+            for key in ((street, plz), ("", plz)) if street else (("", plz),):
+                total = sums[key]
+                total[0] += lat
+                total[1] += lon
+                total[2] += 1
+
+    with open(target_path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["street", "plz", "lat", "lon"])
+        for (street, plz), (lat, lon, count) in sorted(sums.items(), key=lambda item: (item[0][1], item[0][0])):
+            writer.writerow([street, plz, f"{lat / count:.6f}", f"{lon / count:.6f}"])
+    print(f"✅ Газеттир записан: {target_path} ({len(sums)} строк)")
+
+
+def fetch(source_path):
+    # Выгрузка адресных точек из Overpass в CSV для build(): street, postcode, lat, lon
+    import requests
+
+    print("⏳ Overpass: выгружаем адреса Берлина (несколько минут)...")
+    with requests.post(OVERPASS_URL, data={"data": OVERPASS_QUERY}, stream=True, timeout=1000) as response:
+        response.raise_for_status()
+        response.encoding = "utf-8"
+        rows = csv.reader(response.iter_lines(decode_unicode=True), delimiter="\t")
+        next(rows, None)  # заголовок Overpass: addr:street, addr:postcode, @lat, @lon
+        count = 0
+        with open(source_path, "w", encoding="utf-8", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["street", "postcode", "lat", "lon"])
+            for row in rows:
+                if len(row) == 4:
+                    writer.writerow(row)
+                    count += 1
+    print(f"✅ Адресных точек: {count}")
+    return count
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 3 and sys.argv[1] == "build":
+        build(sys.argv[2])
+    elif len(sys.argv) == 2 and sys.argv[1] == "fetch":
+        with tempfile.TemporaryDirectory() as tmp:
+            source = os.path.join(tmp, "berlin_addresses.csv")
+            fetch(source)
+            build(source)
+    else:
+        print("Использование: python gazetteer.py fetch | python gazetteer.py build <адреса.csv>")
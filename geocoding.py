@@ -0,0 +1,196 @@
+import re
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+
+import requests
+
+from gazetteer import get_gazetteer, split_address
+from scraper_core import connection
+
+# Общий геокодер для всех скраперов: in-process LRU → локальный газеттир (улица+PLZ) →
+# таблица geocode_cache → Nominatim → центроид PLZ.
+# Неудачи (адрес не найден) тоже кешируются, но на меньший срок.
+NOMINATIM_URL = "https://nominatim.openstreetmap.org/search"
+USER_AGENT = "Mozilla/5.0 (compatible; AutoWohnBot/1.0)"
+HIT_TTL = timedelta(days=90)
+MISS_TTL = timedelta(days=1)
+LRU_SIZE = 5000
+NOMINATIM_INTERVAL = 1.0  # сек между запросами — политика Nominatim, общая для всех потоков
+
+_lru = OrderedDict()
+_lru_lock = threading.Lock()
+_request_lock = threading.Lock()
+_last_request = 0.0
+_schema_ready = False
+
+_stats_lock = threading.Lock()
+_stats = {"memory": 0, "offline": 0, "db": 0, "network": 0, "network_seconds": 0.0}
+
+
+def ensure_geocode_schema(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS geocode_cache (
+            address_key TEXT PRIMARY KEY,
+            lat REAL,
+            lon REAL,
+            expires_at TIMESTAMPTZ NOT NULL
+        )
+    """)
+
+
+def _init_db():
+    global _schema_ready
+    if _schema_ready:
+        return
+    with connection() as conn:
+        ensure_geocode_schema(conn.cursor())
+        conn.commit()
+    _schema_ready = True
+
+
+def normalize_address(address):
+    key = (address or "").lower().replace("\xa0", " ")
+    key = re.sub(r"\s*,\s*", ", ", key)
+    return " ".join(key.split()).strip(" ,")
+
+
+def _lru_get(key):
+    with _lru_lock:
+        cached = _lru.get(key)
+        if cached is None:
+            return None
+        if cached[2] <= datetime.now(timezone.utc):
+            del _lru[key]
+            return None
+        _lru.move_to_end(key)
+        return cached[0], cached[1]
+
+
+def _lru_put(key, lat, lon, expires_at):
+    with _lru_lock:
+        _lru[key] = (lat, lon, expires_at)
+        _lru.move_to_end(key)
+        while len(_lru) > LRU_SIZE:
+            _lru.popitem(last=False)
+
+
+def _count(kind, seconds=0.0):
+    with _stats_lock:
+        _stats[kind] += 1
+        _stats["network_seconds"] += seconds
+
+
+def _db_get(key):
+    with connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT lat, lon, expires_at FROM geocode_cache WHERE address_key = %s AND expires_at > now()",
+            (key,)
+        )
+        row = cursor.fetchone()
+        conn.rollback()
+    return row
+
+
+def _db_put(key, lat, lon, expires_at):
+    with connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            INSERT INTO geocode_cache (address_key, lat, lon, expires_at)
+            VALUES (%s, %s, %s, %s)
+            ON CONFLICT (address_key) DO UPDATE
+            SET lat = EXCLUDED.lat, lon = EXCLUDED.lon, expires_at = EXCLUDED.expires_at
+        """, (key, lat, lon, expires_at))
+        conn.commit()
+
+
+def _nominatim(address):
+    # None — сетевая ошибка (не кешируем), (None, None) — адрес не найден
+    global _last_request
+    with _request_lock:
+        wait = _last_request + NOMINATIM_INTERVAL - time.monotonic()
+        if wait > 0:
+            time.sleep(wait)
+        try:
+            params = {"q": address, "format": "json", "limit": 1}
+            response = requests.get(NOMINATIM_URL, params=params, headers={"User-Agent": USER_AGENT}, timeout=10)
+            response.raise_for_status()
+            data = response.json()
+        except Exception as e:
+            print(f"⚠️ Nominatim: {address!r}: {e}")
+            return None
+        finally:
+            _last_request = time.monotonic()
+    if data:
+        return float(data[0]["lat"]), float(data[0]["lon"])
+    return None, None
+
+
+def geocode_address(address):
+    key = normalize_address(address)
+    if not key:
+        return None, None
+
+    gazetteer = get_gazetteer()
+    street, plz = split_address(address)
+
+    cached = _lru_get(key)
+    if cached is not None:
+        _count("memory")
+        if cached[0] is None:
+            # Закешированный промах Nominatim — тот же запасной центроид PLZ, что и при первом запросе
+            return gazetteer.lookup_plz(plz) or (None, None)
+        return cached
+
+    # Газеттир: точное или нечёткое совпадение улицы внутри PLZ; адрес без улицы ("10247 Friedrichshain") — центроид PLZ
+    offline = gazetteer.lookup_street(street, plz) if street else gazetteer.lookup_plz(plz)
+    if offline is not None:
+        _count("offline")
+        return offline
+
+    try:
+        _init_db()
+        row = _db_get(key)
+    except Exception as e:
+        print(f"⚠️ geocode_cache недоступен: {e}")
+        row = None
+    if row is not None:
+        _lru_put(key, *row)
+        _count("db")
+        if row[0] is None:
+            return gazetteer.lookup_plz(plz) or (None, None)
+        return row[0], row[1]
+
+    started = time.monotonic()
+    result = _nominatim(address)
+    _count("network", time.monotonic() - started)
+    if result is None:
+        return gazetteer.lookup_plz(plz) or (None, None)
+
+    lat, lon = result
+    expires_at = datetime.now(timezone.utc) + (HIT_TTL if lat is not None else MISS_TTL)
+    _lru_put(key, lat, lon, expires_at)
+    try:
+        _db_put(key, lat, lon, expires_at)
+    except Exception as e:
+        print(f"⚠️ geocode_cache недоступен: {e}")
+    if lat is None:
+        return gazetteer.lookup_plz(plz) or (None, None)
+    return lat, lon
+
+
+def report():
+    # Статистика за цикл опроса; сэкономленное время — средняя стоимость запроса к Nominatim
+    # (включая паузу между запросами) на каждое попадание в кеш
+    with _stats_lock:
+        stats = dict(_stats)
+        _stats.update(memory=0, offline=0, db=0, network=0, network_seconds=0.0)
+    hits = stats["memory"] + stats["offline"] + stats["db"]
+    total = hits + stats["network"]
+    if not total:
+        return
+    per_request = stats["network_seconds"] / stats["network"] if stats["network"] else NOMINATIM_INTERVAL
+    print(f"[GEOCODE] запросов: {total}, попаданий: {hits} ({hits / total:.0%}; память {stats['memory']}, "
+          f"газеттир {stats['offline']}, БД {stats['db']}), Nominatim: {stats['network']}, сэкономлено ~{hits * per_request:.0f} сек")
@@ -0,0 +1,25 @@
+import queue
+import threading
+import time
+
+# Очередь новых объявлений внутри процесса: скраперы кладут сюда id сразу после
+# вставки в listings, а долгоживущий отправитель (telegram_sender.run_pipeline)
+# забирает их без ожидания конца цикла.
+new_listings = queue.Queue()
+# Ставится, когда в процессе есть потребитель очереди (run_pipeline); без него id не копятся —
+# отправитель в другом процессе всё равно получит их через NOTIFY или курсор.
+local_delivery = threading.Event()
+
+# Канал Postgres для отправителя в другом процессе или на другой машине
+# (telegram_sender.run_listener). NOTIFY доставляется только после COMMIT.
+LISTING_CHANNEL = "new_listing"
+
+
+def notify(cursor, listing_ids):
+    # Одно уведомление на каждый id, одним запросом на пачку
+    cursor.execute("SELECT pg_notify(%s, id) FROM unnest(%s::text[]) AS id", (LISTING_CHANNEL, list(listing_ids)))
+
+
+def publish(listing_id):
+    if local_delivery.is_set():
+        new_listings.put((listing_id, time.time()))
@@ -4,19 +4,46 @@ import threading
 import time
 import requests
 import asyncio
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 
 from config import ADMIN_ID, BOT_TOKEN
 
 from Immoscout_bd import run as run_immoscout
 from Immowelt import run as run_immowelt
-from telegram_sender import run as run_sender
+from telegram_sender import run as run_sender, run_pipeline as run_sender_pipeline, run_drain_worker
 from Kleinanzeigen import run as run_kleinanzeigen
 from clean_database import run as run_cleanup
+from subscriptions import run as run_subscription_expiry
+from sender_shards import run_coordinator as run_sender_shards
 from InBerlinwohnen import run as run_inberlinwohnen
+from geocoding import report as report_geocoding
+from gazetteer import require_gazetteer
 from bot_admin import run_admin_bot
+from scheduler import PollingScheduler, SourceSchedule
 
 TELEGRAM_TOKEN = BOT_TOKEN
 
+# Источники опрашиваются параллельно: (имя, функция, лимит времени, мин. и макс. интервал опроса), сек
+SCRAPERS = [
+    ("Immoscout", run_immoscout, 120, 20, 180),
+    ("Immowelt", run_immowelt, 90, 45, 300),
+    ("Kleinanzeigen", run_kleinanzeigen, 150, 30, 300),
+    ("InBerlinWohnen", run_inberlinwohnen, 150, 120, 900),
+]
+CLEANUP_INTERVAL = 60
+# Рассылка из очереди сразу после сохранения объявления, а не в конце цикла
+PIPELINE_MODE = True
+# >0 — рассылка в отдельных процессах по user_id % SENDER_SHARDS (sender_shards), вместо потоков в этом процессе
+SENDER_SHARDS = 0
+
+scraper_pool = ThreadPoolExecutor(max_workers=len(SCRAPERS), thread_name_prefix="scraper")
+running_scrapers = {}  # имя → (future, время запуска, лимит времени)
+overdue_scrapers = set()
+scheduler = PollingScheduler([
+    SourceSchedule(name, min_interval, max_interval)
+    for name, _, _, min_interval, max_interval in SCRAPERS
+])
+
 def send_error_message(context, error):
     try:
         error_type = type(error).__name__
@@ -33,6 +60,65 @@ def send_error_message(context, error):
     except Exception as e:
         print(f"❌ Не удалось отправить сообщение в Telegram: {e}")
 
+def start_scrapers(names):
+    # Источники запускаются независимо: каждый — в свой срок, не дожидаясь остальных.
+    # Поток нельзя прервать принудительно: источник, не уложившийся в лимит,
+    # дорабатывает в фоне и не запускается повторно, пока не завершится.
+    for name, scraper, deadline, _, _ in SCRAPERS:
+        if name not in names:
+            continue
+        if name in running_scrapers:
+            print(f"⏭️ {name}: предыдущий запуск ещё не завершён — пропуск")
+            scheduler.defer(name)
+            continue
+        running_scrapers[name] = (scraper_pool.submit(scraper), time.time(), deadline)
+        scheduler.started(name)
+
+def collect_scrapers(timeout):
+    # Ждёт завершения любого источника (не дольше timeout) и учитывает результаты;
+    # возвращает (сколько источников завершилось, есть ли новые объявления)
+    futures = [future for future, _, _ in running_scrapers.values()]
+    if futures:
+        wait(futures, timeout=timeout, return_when=FIRST_COMPLETED)
+    else:
+        time.sleep(timeout)
+
+    finished = 0
+    found_new = False
+    now = time.time()
+    for name, (future, started, deadline) in list(running_scrapers.items()):
+        if not future.done():
+            if name not in overdue_scrapers and now - started > deadline:
+                overdue_scrapers.add(name)
+                send_error_message(name, TimeoutError(f"Источник не уложился в {deadline} сек"))
+                scheduler.record(name, 0, error=True)
+            continue
+
+        del running_scrapers[name]
+        finished += 1
+        late = name in overdue_scrapers
+        overdue_scrapers.discard(name)
+        try:
+            new_count = future.result() or 0
+        except Exception as e:
+            if not late:
+                send_error_message(name, e)
+                scheduler.record(name, 0, error=True)
+            continue
+        print(f"✅ {name}: {new_count} новых, {round(now - started)} сек{' (после лимита)' if late else ''}")
+        if not late:
+            scheduler.record(name, new_count)
+        if new_count:
+            found_new = True
+    return finished, found_new
+
+def wait_timeout():
+    # До ближайшего срока опроса или лимита времени работающего источника
+    now = time.time()
+    deadlines = [started + deadline - now for name, (_, started, deadline) in running_scrapers.items()
+                 if name not in overdue_scrapers]
+    return max(0.0, min([scheduler.seconds_until_next(), CLEANUP_INTERVAL, *deadlines]))
+
 def run_telegram_bot():
     subprocess.run([sys.executable, "telegram.py"])
 
@@ -40,60 +126,63 @@ def run_admin_bot_async():
     asyncio.run(run_admin_bot())  # ✅ Добавлено
 
 if __name__ == "__main__":
+    require_gazetteer()  # berlin_gazetteer.csv собирается при развёртывании: python gazetteer.py fetch
+
     threading.Thread(target=run_telegram_bot, daemon=True).start()
     print("🤖 Telegram-бот запущен")
 
     threading.Thread(target=run_admin_bot_async, daemon=True).start()  # ✅ Запуск админ-бота
     print("🛠️ Админ-бот запущен")
 
-    while True:
-        print("🔍 Проверка новых объявлений...")
+    if SENDER_SHARDS:
+        threading.Thread(target=run_sender_shards, args=(SENDER_SHARDS,), daemon=True).start()
+        print(f"📨 Шардированная рассылка запущена: {SENDER_SHARDS} процессов")
+    elif PIPELINE_MODE:
+        threading.Thread(target=run_sender_pipeline, daemon=True).start()
+        threading.Thread(target=run_drain_worker, daemon=True).start()
+        print("📨 Потоковая рассылка запущена")
 
-        start_time = time.time()
-        found_new = False
+    last_cleanup = 0.0
+    while True:
+        due = scheduler.due()
+        if due:
+            print(f"🔍 Проверка новых объявлений: {', '.join(due)}")
+            start_scrapers(due)
 
         try:
-            try:
-                if run_immoscout():
-                    found_new = True
-            except Exception as e:
-                send_error_message("Immoscout", e)
-
-            try:
-                if run_immowelt():
-                    found_new = True
-            except Exception as e:
-                send_error_message("Immowelt", e)
+            finished, found_new = collect_scrapers(wait_timeout())
+            if not finished and time.time() - last_cleanup < CLEANUP_INTERVAL:
+                continue
 
-            try:
-                if run_kleinanzeigen():
-                    found_new = True
-            except Exception as e:
-                send_error_message("Kleinanzeigen", e)
+            start_time = time.time()
+            report_geocoding()
 
-            try:
-                if run_inberlinwohnen():
-                    found_new = True
-            except Exception as e:
-                send_error_message("InBerlinWohnen", e)
-
-            if found_new:
+            if found_new and (PIPELINE_MODE or SENDER_SHARDS):
+                print("📬 Новые объявления переданы в потоковую рассылку.")
+            elif found_new:
                 print("📬 Новые объявления найдены! Отправляем пользователям...")
                 try:
                     run_sender()
                 except Exception as e:
                     send_error_message("Рассылка Telegram", e)
-            else:
+            elif finished:
                 print("⏳ Новых объявлений нет.")
 
-            try:
-                print("🧹 Очистка базы данных после парсинга...")
-                run_cleanup()
-            except Exception as e:
-                send_error_message("Очистка БД", e)
+            if time.time() - last_cleanup >= CLEANUP_INTERVAL:
+                last_cleanup = time.time()
+                try:
+                    print("🧹 Очистка базы данных после парсинга...")
+                    run_cleanup()
+                except Exception as e:
+                    send_error_message("Очистка БД", e)
+                try:
+                    run_subscription_expiry()
+                except Exception as e:
+                    send_error_message("Истечение подписок", e)
 
         except Exception as e:
             send_error_message("Main loop", e)
+            continue
 
         duration = time.time() - start_time
         if duration > 180:
@@ -102,5 +191,4 @@ if __name__ == "__main__":
             except TimeoutError as e:
                 send_error_message("Main loop (длительность)", e)
 
-        print("🔁 Ожидание 60 секунд...\n")
-        time.sleep(60)
+        print(f"🔁 Следующий опрос через: {scheduler.summary()}\n")
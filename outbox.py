@@ -0,0 +1,114 @@
+from psycopg2.extras import execute_values
+
+# Очередь доставки в Postgres: сопоставление пишет сюда пары (user_id, listing_id),
+# воркеры рассылки забирают их через FOR UPDATE SKIP LOCKED и удаляют после отправки
+# (в той же транзакции, что и запись в sent_listings — см. sent_records.SentBuffer).
+OUTBOX_CHANNEL = "delivery_outbox"
+CLAIM_TIMEOUT = "5 minutes"  # «sending» дольше этого — воркер упал, строку забирает другой
+CLAIM_HEARTBEAT = 60  # сек: воркер продлевает claimed_at своих строк, пока пачка рассылается
+MAX_ATTEMPTS = 5
+
+PRIORITY_CATCHUP = 0
+PRIORITY_REALTIME = 10
+
+
+def ensure_outbox_schema(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS delivery_outbox (
+            id BIGSERIAL PRIMARY KEY,
+            user_id BIGINT NOT NULL,
+            listing_id TEXT NOT NULL,
+            priority INTEGER NOT NULL DEFAULT 0,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            claimed_at TIMESTAMPTZ,
+            UNIQUE (user_id, listing_id)
+        )
+    """)
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS delivery_outbox_claim_idx
+        ON delivery_outbox (status, priority DESC, id)
+    """)
+
+
+def enqueue(cursor, pairs, priority=PRIORITY_CATCHUP):
+    # pairs: [(user_id, listing_id)]; уже стоящие в очереди и уже отправленные пары пропускаются.
+    # Проверка sent_listings — в том же INSERT: прочитанная заранее, она устаревала бы, если между
+    # чтением и вставкой воркер доставки успел записать отправку и удалить строку очереди
+    if not pairs:
+        return 0
+    rows = execute_values(cursor, """
+        INSERT INTO delivery_outbox (user_id, listing_id, priority)
+        SELECT v.user_id, v.listing_id, v.priority
+        FROM (VALUES %s) AS v (user_id, listing_id, priority)
+        WHERE NOT EXISTS (
+            SELECT 1 FROM sent_listings s WHERE s.user_id = v.user_id AND s.listing_id = v.listing_id
+        )
+        ON CONFLICT (user_id, listing_id) DO NOTHING
+        RETURNING id
+    """, [(user_id, listing_id, priority) for user_id, listing_id in pairs],
+        template="(%s::bigint, %s::text, %s::integer)", fetch=True)
+    if rows:
+        cursor.execute("SELECT pg_notify(%s, '')", (OUTBOX_CHANNEL,))
+    return len(rows)
+
+
+def claim(cursor, limit, shard=None):
+    # shard = (номер, всего): забирать только строки пользователей своего шарда
+    cursor.execute(f"""
+        UPDATE delivery_outbox
+        SET status = 'sending', claimed_at = now(), attempts = attempts + 1
+        WHERE id IN (
+            SELECT id FROM delivery_outbox
+            WHERE (status = 'pending'
+                   OR (status = 'sending' AND claimed_at < now() - interval '{CLAIM_TIMEOUT}'))
+              AND (%s IS NULL OR mod(abs(user_id), %s) = %s)
+            ORDER BY priority DESC, id
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING id, user_id, listing_id, attempts
+    """, (shard and shard[1], shard and shard[1], shard and shard[0], limit))
+    return cursor.fetchall()
+
+
+def drop_sent(cursor, claimed):
+    # Остаток гонки с enqueue: INSERT, ждавший удаления строки очереди незакоммиченной отправкой,
+    # вставляет пару заново. Такие строки удаляются при захвате, не отправляясь; возвращает остальные
+    if not claimed:
+        return claimed
+    cursor.execute("""
+        DELETE FROM delivery_outbox o
+        USING sent_listings s
+        WHERE o.id = ANY(%s) AND s.user_id = o.user_id AND s.listing_id = o.listing_id
+        RETURNING o.id
+    """, ([row[0] for row in claimed],))
+    dropped = {row[0] for row in cursor.fetchall()}
+    return [row for row in claimed if row[0] not in dropped]
+
+
+def extend_claim(cursor, outbox_ids):
+    # Пачка с сотнями сообщений одному пользователю (1 сообщение/с) идёт дольше CLAIM_TIMEOUT —
+    # без продления другой воркер забрал бы ещё не отправленные строки и отправил их повторно
+    if outbox_ids:
+        cursor.execute("""
+            UPDATE delivery_outbox SET claimed_at = now() WHERE id = ANY(%s) AND status = 'sending'
+        """, (list(outbox_ids),))
+
+
+def release(cursor, outbox_ids):
+    # Временная ошибка — вернуть в очередь; исчерпавшие попытки удаляются
+    if not outbox_ids:
+        return
+    cursor.execute("""
+        DELETE FROM delivery_outbox WHERE id = ANY(%s) AND attempts >= %s
+    """, (list(outbox_ids), MAX_ATTEMPTS))
+    cursor.execute("""
+        UPDATE delivery_outbox SET status = 'pending', claimed_at = NULL WHERE id = ANY(%s)
+    """, (list(outbox_ids),))
+
+
+def drop(cursor, outbox_ids):
+    if outbox_ids:
+        cursor.execute("DELETE FROM delivery_outbox WHERE id = ANY(%s)", (list(outbox_ids),))
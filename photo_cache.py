@@ -0,0 +1,46 @@
+from psycopg2.extras import execute_values
+
+# file_id фотографий, уже загруженных в Telegram: следующим получателям того же
+# объявления отправляем их вместо URL портала, и Telegram не качает картинки заново.
+
+
+def ensure_photo_cache_schema(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS listing_photo_cache (
+            listing_id TEXT NOT NULL,
+            position INTEGER NOT NULL,
+            file_id TEXT NOT NULL,
+            PRIMARY KEY (listing_id, position)
+        )
+    """)
+
+
+def load_file_ids(cursor, listing_ids):
+    cursor.execute("""
+        SELECT listing_id, file_id FROM listing_photo_cache
+        WHERE listing_id = ANY(%s)
+        ORDER BY listing_id, position
+    """, (list(listing_ids),))
+    cached = {}
+    for listing_id, file_id in cursor.fetchall():
+        cached.setdefault(listing_id, []).append(file_id)
+    return cached
+
+
+def extract_file_ids(data):
+    # Ответ sendMediaGroup: список сообщений, у каждого photo — размеры по возрастанию
+    file_ids = []
+    for message in (data or {}).get("result") or []:
+        sizes = message.get("photo") or []
+        if not sizes:
+            return []
+        file_ids.append(sizes[-1]["file_id"])
+    return file_ids
+
+
+def store_file_ids(cursor, listing_id, file_ids):
+    execute_values(cursor, """
+        INSERT INTO listing_photo_cache (listing_id, position, file_id)
+        VALUES %s
+        ON CONFLICT (listing_id, position) DO NOTHING
+    """, [(listing_id, position, file_id) for position, file_id in enumerate(file_ids)])
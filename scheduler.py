@@ -0,0 +1,90 @@
+import time
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+BERLIN_TZ = ZoneInfo("Europe/Berlin")
+
+EWMA_ALPHA = 0.3         # вес последнего замера в скользящей средней
+HOURLY_ALPHA = 0.1       # вес замера в средней по часу суток
+ERROR_BACKOFF_LIMIT = 4  # максимум удвоений интервала после ошибок подряд
+NEUTRAL_INTERVAL = 60    # сек: интервал, пока скорость источника ещё не измерена (как в прежнем цикле)
+
+
+class SourceSchedule:
+    # Интервал опроса ≈ время, за которое на портале появляется одно новое объявление.
+    # Скорость поступления оценивается EWMA — общей и отдельно для каждого часа
+    # суток по Берлину, чтобы ночью опрашивать реже, а в часы пик — чаще.
+    def __init__(self, name, min_interval, max_interval):
+        self.name = name
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.rate = None               # новых объявлений в секунду; None — ещё нет ни одного замера
+        self.hourly_rate = [None] * 24
+        self.errors = 0
+        self.last_run = None
+        self.next_run = 0.0
+
+    def is_due(self, now):
+        return now >= self.next_run
+
+    def record(self, new_count, now=None, error=False):
+        now = now or time.time()
+        hour = datetime.fromtimestamp(now, BERLIN_TZ).hour
+
+        if error:
+            self.errors += 1
+        else:
+            self.errors = 0
+            if self.last_run is not None:
+                elapsed = max(now - self.last_run, 1.0)
+                sample = new_count / elapsed
+                self.rate = sample if self.rate is None else EWMA_ALPHA * sample + (1 - EWMA_ALPHA) * self.rate
+                previous = self.hourly_rate[hour]
+                self.hourly_rate[hour] = sample if previous is None else (
+                    HOURLY_ALPHA * sample + (1 - HOURLY_ALPHA) * previous
+                )
+            self.last_run = now
+
+        self.next_run = now + self.interval(hour)
+        return self.next_run
+
+    def interval(self, hour):
+        hourly = self.hourly_rate[hour]
+        if self.rate is None:
+            interval = NEUTRAL_INTERVAL
+        else:
+            rate = self.rate if hourly is None else (self.rate + hourly) / 2
+            interval = 1 / rate if rate > 0 else self.max_interval
+        interval = min(max(interval, self.min_interval), self.max_interval)
+        return interval * 2 ** min(self.errors, ERROR_BACKOFF_LIMIT)
+
+
+class PollingScheduler:
+    def __init__(self, schedules):
+        self.schedules = {s.name: s for s in schedules}
+
+    def due(self, now=None):
+        now = now or time.time()
+        return [name for name, s in self.schedules.items() if s.is_due(now)]
+
+    def record(self, name, new_count, error=False):
+        return self.schedules[name].record(new_count, error=error)
+
+    def started(self, name):
+        # Пока источник работает, он не считается «к опросу»; срок задаст record() по завершении
+        self.schedules[name].next_run = float("inf")
+
+    def defer(self, name):
+        schedule = self.schedules[name]
+        schedule.next_run = time.time() + schedule.min_interval
+
+    def seconds_until_next(self, now=None):
+        now = now or time.time()
+        return max(0.0, min(s.next_run for s in self.schedules.values()) - now)
+
+    def summary(self):
+        now = time.time()
+        return ", ".join(
+            f"{name}: {'работает' if s.next_run == float('inf') else f'{round(max(0.0, s.next_run - now))}s'}"
+            for name, s in self.schedules.items()
+        )
@@ -0,0 +1,269 @@
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+from psycopg2.extras import execute_values
+from psycopg2.pool import ThreadedConnectionPool
+
+from config import DB_CONFIG
+from listing_events import notify, publish
+
+BERLIN_TZ = ZoneInfo("Europe/Berlin")
+
+# Общий слой записи объявлений: скраперы отдают нормализованные записи, а соединение из пула,
+# дедупликация, пакетная вставка и уведомления отправителя живут здесь.
+POOL_MIN = 1
+POOL_MAX = 8       # скраперы идут параллельно в ThreadPoolExecutor главного цикла
+BATCH_ROWS = 50    # столько записей копится до одной вставки с одним COMMIT
+FLUSH_INTERVAL = 2.0  # сек: дольше запись не ждёт пачку, чтобы не задерживать рассылку
+
+# Флаги источника: source_immoscout, source_kleinanzeigen, source_immowelt, source_wggesucht, source_inberlinwohnen
+SOURCES = {
+    "immoscout": (1, 0, 0, 0, 0),
+    "kleinanzeigen": (0, 1, 0, 0, 0),
+    "immowelt": (0, 0, 1, 0, 0),
+    "inberlinwohnen": (0, 0, 0, 0, 1),
+}
+
+INSERT_COLUMNS = (
+    "id", "url", "price", "price_warm", "size", "address", "lat", "lon", "swapflat",
+    "wbs_required", "created_at", "source_immoscout", "source_kleinanzeigen",
+    "source_immowelt", "source_wggesucht", "source_inberlinwohnen", "photo_url", "is_active", "last_checked",
+)
+# created_at ставит сама вставка: курсор рассылки (created_at, id) должен расти в порядке COMMIT,
+# а не в порядке add() — иначе строка из долгой пачки окажется позади уже пройденного курсора
+INSERT_TEMPLATE = "(" + ", ".join("now()" if column == "created_at" else "%s" for column in INSERT_COLUMNS) + ")"
+
+_pool = None
+_pool_lock = threading.Lock()
+_schema_ready = False
+
+
+def get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadedConnectionPool(POOL_MIN, POOL_MAX, **DB_CONFIG)
+    return _pool
+
+
+@contextmanager
+def connection():
+    pool = get_pool()
+    conn = pool.getconn()
+    try:
+        yield conn
+    except Exception:
+        if not conn.closed:
+            conn.rollback()
+        raise
+    finally:
+        pool.putconn(conn, close=bool(conn.closed))
+
+
+def init_db():
+    global _schema_ready
+    if _schema_ready:
+        return
+    with connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS listings (
+                id TEXT PRIMARY KEY,
+                url TEXT,
+                price REAL,
+                price_warm REAL,
+                size REAL,
+                address TEXT,
+                lat REAL,
+                lon REAL,
+                swapflat INTEGER,
+                wbs_required INTEGER,
+                created_at TIMESTAMPTZ,
+                source_immoscout INTEGER,
+                source_kleinanzeigen INTEGER,
+                source_immowelt INTEGER,
+                photo_url TEXT,
+                is_active TEXT,
+                last_checked TEXT,
+                source_wggesucht INTEGER,
+                source_inberlinwohnen INTEGER
+            )
+        """)
+        conn.commit()
+    _schema_ready = True
+
+
+def clean_price_size(value, strict=False):
+    # strict — отбрасывать неоднозначные числа вроде "1,234,5" или "1,5.000" (ImmoScout)
+    if not value:
+        return None
+    val = value.replace("\xa0", "").replace("€", "").replace("m²", "").strip()
+    if strict:
+        if val.count(",") > 1:
+            return None
+        if "," in val:
+            last_dot = val.rfind(".")
+            comma_pos = val.find(",")
+            if last_dot != -1 and comma_pos < last_dot:
+                return None
+    val = val.replace(".", "").replace(",", ".")
+    try:
+        return float(val)
+    except ValueError:
+        return None
+
+
+def known_ids(ids):
+    # Какие из id страницы результатов уже есть в listings — одним запросом по первичному ключу,
+    # до загрузки деталей и геокодирования
+    ids = [str(obj_id) for obj_id in ids]
+    if not ids:
+        return set()
+    init_db()
+    with connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT id FROM listings WHERE id = ANY(%s)", (ids,))
+        known = {row[0] for row in cursor.fetchall()}
+        conn.rollback()
+    return known
+
+
+class ListingWriter:
+    # Копит записи и вставляет их пачкой: INSERT ... ON CONFLICT DO NOTHING RETURNING id,
+    # NOTIFY для каждого реально нового id и один COMMIT на пачку; после COMMIT id уходят
+    # в очередь потоковой рассылки. Используется как контекстный менеджер — остаток сбрасывается на выходе.
+    # Неполная пачка уходит по таймеру через FLUSH_INTERVAL, даже если скрапер долго грузит следующую страницу.
+    def __init__(self, source, table="listings", batch_rows=BATCH_ROWS, notify_new=True):
+        self.flags = SOURCES[source]
+        self.table = table
+        self.batch_rows = batch_rows
+        self.notify_new = notify_new
+        self.rows = {}
+        self.inserted = 0
+        self.lock = threading.Lock()
+        self.timer = None
+
+    def add(self, obj_id, listing):
+        now = datetime.now(BERLIN_TZ)
+        immoscout, kleinanzeigen, immowelt, wggesucht, inberlinwohnen = self.flags
+        row = (
+            str(obj_id),
+            listing["url"],
+            listing["price"],
+            listing.get("price_warm"),
+            listing["size"],
+            listing["address"],
+            listing["lat"],
+            listing["lon"],
+            int(listing.get("swapflat") or 0),
+            int(listing.get("wbs_required") or 0),
+            immoscout, kleinanzeigen, immowelt, wggesucht, inberlinwohnen,
+            listing["photo_url"],
+            "1",
+            now.isoformat(timespec="seconds"),
+        )
+        with self.lock:
+            self.rows[row[0]] = row
+            if len(self.rows) >= self.batch_rows:
+                self._flush()
+            elif self.timer is None:
+                self.timer = threading.Timer(FLUSH_INTERVAL, self._flush_on_timer)
+                self.timer.daemon = True
+                self.timer.start()
+
+    def flush(self):
+        with self.lock:
+            return self._flush()
+
+    def _flush_on_timer(self):
+        try:
+            self.flush()
+        except Exception as e:
+            print(f"⚠️ Запись пачки {self.table} по таймеру: {e} — повторим со следующей")
+
+    def _flush(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        if not self.rows:
+            return []
+        rows = list(self.rows.values())
+        self.rows = {}
+        try:
+            with connection() as conn:
+                cursor = conn.cursor()
+                inserted = [row[0] for row in execute_values(cursor, f"""
+                    INSERT INTO {self.table} ({", ".join(INSERT_COLUMNS)})
+                    VALUES %s
+                    ON CONFLICT (id) DO NOTHING
+                    RETURNING id
+                """, rows, template=INSERT_TEMPLATE, page_size=len(rows), fetch=True)]
+                if inserted and self.notify_new:
+                    notify(cursor, inserted)
+                conn.commit()
+        except Exception:
+            # Пачка не потеряна: уйдёт со следующей записью или на выходе из with
+            self.rows = {**{row[0]: row for row in rows}, **self.rows}
+            raise
+        if self.notify_new:
+            for obj_id in inserted:
+                publish(obj_id)
+        self.inserted += len(inserted)
+        return inserted
+
+    def __enter__(self):
+        init_db()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.flush()
+
+
+def benchmark(rows=2000):
+    # Построчная вставка с COMMIT на каждую запись (как было в скраперах) против ListingWriter
+    init_db()
+    with connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("DROP TABLE IF EXISTS listings_bench")
+        cursor.execute("CREATE TABLE listings_bench (LIKE listings INCLUDING ALL)")
+        conn.commit()
+
+    listing = {"url": "https://example.org", "price": 900.0, "price_warm": 1100.0, "size": 55.0,
+               "address": "Sonnenallee 1, 12047 Berlin", "lat": 52.48, "lon": 13.43, "photo_url": ""}
+    try:
+        with connection() as conn:
+            cursor = conn.cursor()
+            started = time.perf_counter()
+            for i in range(rows):
+                now = datetime.now(BERLIN_TZ)
+                cursor.execute(f"""
+                    INSERT INTO listings_bench ({", ".join(INSERT_COLUMNS)})
+                    VALUES ({", ".join(["%s"] * len(INSERT_COLUMNS))})
+                    ON CONFLICT (id) DO NOTHING
+                """, (f"row-{i}", listing["url"], listing["price"], listing["price_warm"], listing["size"],
+                      listing["address"], listing["lat"], listing["lon"], 0, 0, now, 1, 0, 0, 0, 0,
+                      listing["photo_url"], "1", now.isoformat(timespec="seconds")))
+                conn.commit()
+            per_row = time.perf_counter() - started
+            cursor.execute("TRUNCATE listings_bench")
+            conn.commit()
+
+        started = time.perf_counter()
+        with ListingWriter("immoscout", table="listings_bench", notify_new=False) as writer:
+            for i in range(rows):
+                writer.add(f"row-{i}", listing)
+        batched = time.perf_counter() - started
+    finally:
+        with connection() as conn:
+            conn.cursor().execute("DROP TABLE IF EXISTS listings_bench")
+            conn.commit()
+
+    print(f"{rows} объявлений: по одному с COMMIT — {per_row:.2f} сек, пачками по {BATCH_ROWS} — {batched:.2f} сек "
+          f"(×{per_row / max(batched, 1e-9):.1f})")
+
+
+if __name__ == "__main__":
+    benchmark()
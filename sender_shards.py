@@ -0,0 +1,74 @@
+import multiprocessing
+import os
+import sys
+import threading
+import time
+
+# Шардированная рассылка: N процессов, каждый сопоставляет и рассылает только пользователям
+# с |user_id| % N == номер шарда (у групп id отрицательный). Все шарды слушают один канал
+# новых объявлений, у каждого своё соединение с БД, свой курсор догоняющего прохода и свои
+# записи в sent_listings. Лимит Bot API шарды делят поровну (telegram_sender.set_sender_processes).
+SHARDS = os.cpu_count() or 1
+MONITOR_INTERVAL = 5  # сек между проверками, живы ли шарды
+# Фильтры пользователей публикуются координатором в shared memory (user_table, нужен numpy),
+# шарды берут их оттуда вместо чтения users из БД
+SHARED_USER_TABLE = True
+
+
+def run_shard(index, count, table_prefix=None, senders=None):
+    import telegram_sender
+    from telegram_sender import run_drain_worker, run_listener, set_sender_processes
+
+    set_sender_processes(senders or count)
+
+    if table_prefix:
+        from user_table import UserTableReader
+        telegram_sender.user_table = UserTableReader(table_prefix)
+
+    shard = (index, count)
+    print(f"[SHARD {index}/{count}] Запущен (pid {os.getpid()})")
+    threading.Thread(target=run_drain_worker, args=(shard,), daemon=True).start()
+    run_listener(shard)
+
+
+def run_coordinator(count=SHARDS, senders=None):
+    # senders — все процессы рассылки бота, включая отдельные --drain; по умолчанию только шарды
+    # spawn, а не fork: родитель многопоточный, соединения и потоки наследовать нельзя
+    context = multiprocessing.get_context("spawn")
+    workers = {}
+    publisher = None
+    if SHARED_USER_TABLE:
+        from user_table import UserTablePublisher
+        publisher = UserTablePublisher()
+        threading.Thread(target=publisher.run, daemon=True).start()
+    table_prefix = publisher and publisher.prefix
+
+    def start(index):
+        process = context.Process(target=run_shard, args=(index, count, table_prefix, senders),
+                                  name=f"sender-{index}", daemon=True)
+        process.start()
+        workers[index] = process
+
+    for index in range(count):
+        start(index)
+    print(f"[SHARDS] Запущено процессов рассылки: {count}")
+
+    try:
+        while True:
+            time.sleep(MONITOR_INTERVAL)
+            for index, process in list(workers.items()):
+                if not process.is_alive():
+                    print(f"[SHARDS] ⚠️ Шард {index} завершился (код {process.exitcode}), перезапускаем")
+                    start(index)
+    finally:
+        for process in workers.values():
+            process.terminate()
+        if publisher is not None:
+            publisher.close()
+
+
+if __name__ == "__main__":
+    from telegram_sender import senders_from_argv
+
+    count = int(sys.argv[1]) if len(sys.argv) > 1 and sys.argv[1].isdigit() else SHARDS
+    run_coordinator(count, senders_from_argv(sys.argv, count))
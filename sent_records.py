@@ -0,0 +1,91 @@
+import time
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+import psycopg2
+from psycopg2.extras import execute_values
+
+BERLIN_TZ = ZoneInfo("Europe/Berlin")
+
+FLUSH_ROWS = 200
+FLUSH_INTERVAL = 2.0  # сек: дольше запись в буфере не лежит
+
+INSERT_SQL = "INSERT INTO sent_listings (user_id, listing_id, url, sent_at) VALUES %s"
+
+
+class SentBuffer:
+    # Копит успешные отправки и пишет их в sent_listings пачкой с одним COMMIT,
+    # в той же транзакции удаляя выполненные строки delivery_outbox.
+    # Всё, что уже сброшено, закоммичено и при перезапуске не уйдёт повторно;
+    # потерять при падении можно только последние FLUSH_INTERVAL секунд.
+    def __init__(self, conn, table_sql=INSERT_SQL, max_rows=FLUSH_ROWS, max_interval=FLUSH_INTERVAL):
+        self.conn = conn
+        self.table_sql = table_sql
+        self.max_rows = max_rows
+        self.max_interval = max_interval
+        self.rows = []
+        self.outbox_ids = []
+        self.last_flush = time.monotonic()
+        self.flushed = 0
+
+    def add(self, user_id, listing_id, url, outbox_id=None):
+        self.rows.append((user_id, listing_id, url, datetime.now(BERLIN_TZ).isoformat(timespec="seconds")))
+        if outbox_id is not None:
+            self.outbox_ids.append(outbox_id)
+        if len(self.rows) >= self.max_rows:
+            self.flush()
+        else:
+            self.flush_if_due()
+
+    def flush_if_due(self):
+        if self.rows and time.monotonic() - self.last_flush >= self.max_interval:
+            self.flush()
+
+    def flush(self):
+        self.last_flush = time.monotonic()
+        if not self.rows:
+            return
+        with self.conn.cursor() as cursor:
+            execute_values(cursor, self.table_sql, self.rows, page_size=len(self.rows))
+            if self.outbox_ids:
+                cursor.execute("DELETE FROM delivery_outbox WHERE id = ANY(%s)", (self.outbox_ids,))
+        self.conn.commit()
+        self.flushed += len(self.rows)
+        self.rows = []
+        self.outbox_ids = []
+
+
+def benchmark(rows=5000):
+    from config import DB_CONFIG
+
+    conn = psycopg2.connect(**DB_CONFIG)
+    cursor = conn.cursor()
+    cursor.execute("""
+        CREATE TEMP TABLE sent_listings_bench (user_id BIGINT, listing_id TEXT, url TEXT, sent_at TEXT)
+    """)
+    conn.commit()
+    sent_at = datetime.now(BERLIN_TZ).isoformat(timespec="seconds")
+
+    started = time.perf_counter()
+    for i in range(rows):
+        cursor.execute(
+            "INSERT INTO sent_listings_bench (user_id, listing_id, url, sent_at) VALUES (%s, %s, %s, %s)",
+            (i, str(i), "https://example.org", sent_at)
+        )
+        conn.commit()
+    per_row = time.perf_counter() - started
+
+    buffer = SentBuffer(conn, "INSERT INTO sent_listings_bench (user_id, listing_id, url, sent_at) VALUES %s")
+    started = time.perf_counter()
+    for i in range(rows):
+        buffer.add(i, str(i), "https://example.org")
+    buffer.flush()
+    batched = time.perf_counter() - started
+
+    conn.close()
+    print(f"{rows} записей: по одной с COMMIT — {per_row:.2f} сек, пачками по {FLUSH_ROWS} — {batched:.2f} сек "
+          f"(×{per_row / max(batched, 1e-9):.1f})")
+
+
+if __name__ == "__main__":
+    benchmark()
@@ -0,0 +1,70 @@
+import math
+from collections import defaultdict
+
+EARTH_RADIUS = 6371000  # как в telegram_sender.calculate_distance
+CELL_SIZE = 0.02        # град. ≈ 2.2 км по широте, 1.3 км по долготе в Берлине
+MAX_CELLS_PER_AREA = 2500
+BBOX_PADDING = 1e-9     # запас на погрешность float в point_in_polygon
+
+
+def circle_bbox(lat, lon, radius):
+    # Точные границы круга для гаверсинуса: по широте — угловой радиус,
+    # по долготе — максимальное отклонение asin(sin(d) / cos(lat)).
+    d = radius / EARTH_RADIUS
+    dlat = math.degrees(d)
+    cos_lat = math.cos(math.radians(lat))
+    if math.sin(d) >= cos_lat:
+        return lat - dlat, -180.0, lat + dlat, 180.0
+    dlon = math.degrees(math.asin(math.sin(d) / cos_lat))
+    return lat - dlat, lon - dlon, lat + dlat, lon + dlon
+
+
+def polygon_bbox(polygon):
+    lats = [p[0] for p in polygon]
+    lons = [p[1] for p in polygon]
+    return min(lats), min(lons), max(lats), max(lons)
+
+
+class SpatialGridIndex:
+    # Равномерная сетка по bbox зон поиска: ключ пользователя попадает во все ячейки,
+    # которые пересекает его bbox. Запрос по точке возвращает только кандидатов,
+    # точная проверка (радиус / многоугольник) остаётся на вызывающем коде.
+    def __init__(self, cell_size=CELL_SIZE):
+        self.cell_size = cell_size
+        self.cells = defaultdict(list)
+        self.large = []  # слишком большие зоны проверяются для каждой точки
+        self.bboxes = {}
+
+    def _cell(self, lat, lon):
+        return math.floor(lat / self.cell_size), math.floor(lon / self.cell_size)
+
+    def add(self, key, bbox):
+        min_lat, min_lon, max_lat, max_lon = bbox
+        bbox = (min_lat - BBOX_PADDING, min_lon - BBOX_PADDING,
+                max_lat + BBOX_PADDING, max_lon + BBOX_PADDING)
+        self.bboxes[key] = bbox
+        lat_lo, lon_lo = self._cell(bbox[0], bbox[1])
+        lat_hi, lon_hi = self._cell(bbox[2], bbox[3])
+        if (lat_hi - lat_lo + 1) * (lon_hi - lon_lo + 1) > MAX_CELLS_PER_AREA:
+            self.large.append(key)
+            return
+        for i in range(lat_lo, lat_hi + 1):
+            for j in range(lon_lo, lon_hi + 1):
+                self.cells[(i, j)].append(key)
+
+    def add_circle(self, key, lat, lon, radius):
+        self.add(key, circle_bbox(lat, lon, radius))
+
+    def add_polygon(self, key, polygon):
+        self.add(key, polygon_bbox(polygon))
+
+    def candidates(self, lat, lon):
+        result = []
+        for key in self.cells.get(self._cell(lat, lon), []) + self.large:
+            min_lat, min_lon, max_lat, max_lon = self.bboxes[key]
+            if min_lat <= lat <= max_lat and min_lon <= lon <= max_lon:
+                result.append(key)
+        return result
+
+    def __len__(self):
+        return len(self.bboxes)
@@ -0,0 +1,59 @@
+import psycopg2
+
+from config import DB_CONFIG
+
+# subscribed_until хранится как TIMESTAMP по берлинскому времени (без зоны)
+BERLIN_NOW = "(now() AT TIME ZONE 'Europe/Berlin')"
+
+# Условие «подписка действует»: пустая дата означает бессрочный доступ
+ACTIVE_SUBSCRIPTION_SQL = f"(subscribed_until IS NULL OR subscribed_until >= {BERLIN_NOW})"
+
+
+def ensure_subscription_schema(cursor):
+    # Раньше subscribed_until был TEXT с ISO-строкой — переводим в TIMESTAMP
+    cursor.execute("""
+        SELECT data_type FROM information_schema.columns
+        WHERE table_name = 'users' AND column_name = 'subscribed_until'
+    """)
+    row = cursor.fetchone()
+    if row and row[0] == "text":
+        cursor.execute("""
+            ALTER TABLE users
+            ALTER COLUMN subscribed_until TYPE TIMESTAMP USING NULLIF(subscribed_until, '')::timestamp
+        """)
+        print("[DB] users.subscribed_until переведён в TIMESTAMP")
+    # CREATE INDEX блокирует запись в users даже с IF NOT EXISTS — сначала проверяем, есть ли индекс
+    cursor.execute("SELECT to_regclass('users_searching_subscribed_idx')")
+    if cursor.fetchone()[0] is None:
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS users_searching_subscribed_idx
+            ON users (subscribed_until) WHERE is_searching = 1
+        """)
+
+
+def expire_subscriptions(cursor):
+    # Один UPDATE вместо проверки каждого пользователя; возвращает id отключённых
+    cursor.execute(f"""
+        UPDATE users SET is_searching = 0
+        WHERE is_searching = 1 AND subscribed_until < {BERLIN_NOW}
+        RETURNING id
+    """)
+    return [row[0] for row in cursor.fetchall()]
+
+
+def run():
+    conn = psycopg2.connect(**DB_CONFIG)
+    try:
+        cursor = conn.cursor()
+        ensure_subscription_schema(cursor)
+        expired = expire_subscriptions(cursor)
+        conn.commit()
+    finally:
+        conn.close()
+    if expired:
+        print(f"[SUBSCRIPTION] 🔕 Подписка истекла, поиск отключён: {len(expired)} польз.")
+    return expired
+
+
+if __name__ == "__main__":
+    run()
@@ -2,6 +2,7 @@
 from config import DB_CONFIG  # где DB_CONFIG хранит параметры подключения
 from config import TOKEN
 from translations import translations, SUPPORTED_LANGUAGES, DEFAULT_LANGUAGE
+from subscriptions import ACTIVE_SUBSCRIPTION_SQL, ensure_subscription_schema, expire_subscriptions
 
 def get_db_connection():
     return psycopg2.connect(**DB_CONFIG)
@@ -102,7 +103,7 @@ def create_users_table():
                        DEFAULT
                        1,
                        subscribed_until
-                       TEXT,
+                       TIMESTAMP,
                        is_searching
                        BOOLEAN
                        DEFAULT
@@ -121,7 +122,9 @@ def create_users_table():
         ("last_name", "TEXT"),
         ("username", "TEXT"),
         ("language", "TEXT DEFAULT 'en'"),
-        ("referred_by", "INTEGER DEFAULT NULL")
+        ("referred_by", "INTEGER DEFAULT NULL"),
+        ("filters_version", "INTEGER DEFAULT 0"),
+        ("digest_mode", "INTEGER DEFAULT 0")
     ]:
         cursor.execute("""
                 SELECT 1 FROM information_schema.columns
@@ -130,6 +133,7 @@ def create_users_table():
         if not cursor.fetchone():
             cursor.execute(f"ALTER TABLE users ADD COLUMN {column} {col_type}")
             logger.info(f"[DB] Added column '{column}' of type '{col_type}' to users table.")
+    ensure_subscription_schema(cursor)
     conn.commit()
     conn.close()
 
@@ -202,7 +206,7 @@ async def add_user_to_db(user: types.User, referrer_id=None):
                            sanitize(user.first_name),
                            sanitize(user.last_name),
                            user.username,
-                           trial_end.isoformat(),
+                           trial_end,
                            0,
                            referrer_id
                        ))
@@ -213,14 +217,11 @@ async def add_user_to_db(user: types.User, referrer_id=None):
             cursor.execute("SELECT subscribed_until, language FROM users WHERE id = %s", (referrer_id,))
             ref_row = cursor.fetchone()
             if ref_row:
-                try:
-                    current_sub = datetime.fromisoformat(ref_row[0]) if ref_row[0] else datetime.now()
-                except Exception:
-                    current_sub = datetime.now()
+                current_sub = ref_row[0] or datetime.now()
 
                 bonus_sub = current_sub + timedelta(days=14)
                 cursor.execute("UPDATE users SET subscribed_until = %s WHERE id = %s",
-                               (bonus_sub.isoformat(), referrer_id))
+                               (bonus_sub, referrer_id))
                 logger.info(f"[REFERRAL] User {referrer_id} got +14 days for inviting {user.id}")
 
                 # Notification to referrer
@@ -265,7 +266,7 @@ def save_user_filters(user_id, location, min_price, max_price, min_size, max_siz
                        INSERT INTO users (id, location, min_price, max_price, min_size, max_size,
                                           tauschwohnung, wbs,
                                           use_immoscout, use_kleinanzeigen, use_immowelt, use_inberlinwohnen)
-                       VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s) ON CONFLICT(id) DO
+                       VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s) ON CONFLICT(id) DO
                        UPDATE SET
                            location = excluded.location,
                            min_price = excluded.min_price,
@@ -277,7 +278,8 @@ def save_user_filters(user_id, location, min_price, max_price, min_size, max_siz
                            use_immoscout = excluded.use_immoscout,
                            use_kleinanzeigen = excluded.use_kleinanzeigen,
                            use_immowelt = excluded.use_immowelt,
-                           use_inberlinwohnen = excluded.use_inberlinwohnen
+                           use_inberlinwohnen = excluded.use_inberlinwohnen,
+                           filters_version = COALESCE(users.filters_version, 0) + 1
                        """, (user_id, location, min_price, max_price, min_size, max_size,
                              tauschwohnung, wbs, use_immoscout, use_kleinanzeigen, use_immowelt, use_inberlinwohnen))
         conn.commit()
@@ -415,7 +417,7 @@ async def select_language(message: types.Message):
     trial_end_text = ""
     if row and row[0]:
         try:
-            sub_until = datetime.fromisoformat(row[0])
+            sub_until = row[0]
             days = (sub_until.date() - datetime.now().date()).days
             trial_end_text = translations[lang]["welcome_message"].format(
                 date=sub_until.strftime("%d.%m.%Y"),
@@ -470,28 +472,23 @@ async def pre_checkout_query(query: PreCheckoutQuery):
 def check_subscription(user_id):
     conn = get_db_connection()
     cursor = conn.cursor()
-    cursor.execute("SELECT subscribed_until, is_searching FROM users WHERE id = %s", (user_id,))
+    cursor.execute(f"SELECT subscribed_until, {ACTIVE_SUBSCRIPTION_SQL} FROM users WHERE id = %s", (user_id,))
     row = cursor.fetchone()
-    conn.close()
-
-    if not row or not row[0]:
-        return False
 
     try:
-        sub_until = datetime.fromisoformat(row[0])
-        now = datetime.now()
-        if sub_until < now:
-            # Subscription expired, disable searching
-            conn = get_db_connection()
-            cursor = conn.cursor()
-            cursor.execute("UPDATE users SET is_searching = 0 WHERE id = %s", (user_id,))
+        if not row or not row[0]:
+            return False
+        if not row[1]:
+            # Subscription expired: one set-based UPDATE disables every expired user, this one included
+            expire_subscriptions(cursor)
             conn.commit()
-            conn.close()
             return False
         return True
     except Exception as e:
         logger.error(f"[DB] Error checking subscription: {e}")
         return False
+    finally:
+        conn.close()
 
 
 def get_subscription_warning_message(subscribed_until: datetime, lang: str) -> str:
@@ -516,7 +513,7 @@ async def my_subscription_handler(message: types.Message):
 
     if row and row[0]:
         try:
-            sub_until = datetime.fromisoformat(row[0])
+            sub_until = row[0]
             if sub_until > datetime.now():
                 remaining = (sub_until - datetime.now()).days
                 warning_msg = get_subscription_warning_message(sub_until, lang)
@@ -553,20 +550,12 @@ async def handle_successful_payment(message: types.Message):
     cursor.execute("SELECT subscribed_until FROM users WHERE id = %s", (user_id,))
     row = cursor.fetchone()
 
-    if row and row[0]:
-        try:
-            current_until = datetime.fromisoformat(row[0])
-            if current_until > now:
-                new_until = current_until + timedelta(days=30)
-            else:
-                new_until = now + timedelta(days=30)
-        except Exception as e:
-            logger.warning(f"[PAYMENT] Date parsing error: {e}")
-            new_until = now + timedelta(days=30)
+    if row and row[0] and row[0] > now:
+        new_until = row[0] + timedelta(days=30)
     else:
         new_until = now + timedelta(days=30)
 
-    cursor.execute("UPDATE users SET subscribed_until = %s WHERE id = %s", (new_until.isoformat(), user_id))
+    cursor.execute("UPDATE users SET subscribed_until = %s WHERE id = %s", (new_until, user_id))
     conn.commit()
     conn.close()
 
@@ -807,12 +796,8 @@ async def subscription_reminder_loop():
             users = cursor.fetchall()
             conn.close()
 
-            for user_id, sub_until_str, lang in users:
-                if not sub_until_str:
-                    continue
-                try:
-                    sub_until = datetime.fromisoformat(sub_until_str)
-                except Exception:
+            for user_id, sub_until, lang in users:
+                if not sub_until:
                     continue
 
                 days_left = (sub_until.date() - now.date()).days
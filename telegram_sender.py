@@ -1,15 +1,62 @@
-﻿import psycopg2
+﻿import asyncio
+import psycopg2
 import math
-import requests
+import queue
+import select
+import sys
+import time
 from datetime import datetime, timedelta
 from zoneinfo import ZoneInfo
 from urllib.parse import quote, quote_plus
-from config import BOT_TOKEN
 from config import DB_CONFIG
+from delivery import GLOBAL_RATE, DeliveryEngine, DeliveryJob, interleave_by_chat, latency_report
+from sent_records import SentBuffer
+from listing_events import LISTING_CHANNEL, local_delivery, new_listings
+from photo_cache import ensure_photo_cache_schema, extract_file_ids, load_file_ids, store_file_ids
+from outbox import (CLAIM_HEARTBEAT, OUTBOX_CHANNEL, PRIORITY_CATCHUP, PRIORITY_REALTIME,
+                    claim, drop, drop_sent, enqueue, ensure_outbox_schema, extend_claim, release)
+from user_filters import FilterCache
+from subscriptions import ACTIVE_SUBSCRIPTION_SQL, ensure_subscription_schema, expire_subscriptions
+from user_changes import LiveUsers, ensure_user_change_trigger
 
-TELEGRAM_API_URL = f"https://api.telegram.org/bot{BOT_TOKEN}/sendMessage"
-TELEGRAM_MEDIA_GROUP_URL = f"https://api.telegram.org/bot{BOT_TOKEN}/sendMediaGroup"
 BERLIN_TZ = ZoneInfo("Europe/Berlin")
+PIPELINE_BATCH_WINDOW = 0.5  # сек: сколько ждать соседние объявления, прежде чем отправлять
+LISTEN_POLL_TIMEOUT = 5
+OUTBOX_BATCH = 500
+LISTINGS_PAGE_SIZE = 200
+CURSOR_SAFETY_LAG = 5
+DRAIN_POLL_INTERVAL = 5
+RETRY_INTERVAL = 5        # сек: пауза перед повтором догоняющего прохода или пакета после ошибки
+RETRY_INTERVAL_MAX = 60
+# сек между проходами курсора в долгоживущих режимах: realtime-пакеты курсор не двигают,
+# без проходов перезапуск догонял бы всё, что появилось с прошлого старта
+CURSOR_PASS_INTERVAL = 300
+# Ключ pg_advisory_xact_lock: настройку схемы выполняет один отправитель за раз
+# (поток доставки и поток сопоставления в main.py, N процессов sender_shards стартуют вместе)
+SCHEMA_LOCK_KEY = 7406020
+# "index" — сетка по зонам поиска, "numpy" — матрица совпадений целиком (vector_match, нужен numpy)
+MATCH_ENGINE = "index"
+# Режим дайджеста (users.digest_mode): больше DIGEST_THRESHOLD совпадений в одной пачке
+# уходят одним сообщением со ссылками, по DIGEST_MAX_ITEMS объявлений на сообщение
+DIGEST_THRESHOLD = 3
+DIGEST_MAX_ITEMS = 10
+
+filter_cache = FilterCache()
+# user_table.UserTableReader в процессах шардированной рассылки; None — пользователи читаются из БД
+user_table = None
+# shard → user_changes.LiveUsers: снимок пользователей, обновляемый по NOTIFY из триггера на users
+live_users = {}
+schema_ready = False
+delivery_engine = DeliveryEngine()
+# Сколько процессов одновременно рассылают от имени бота (шарды + отдельные --drain):
+# лимит Bot API общий, каждый получает GLOBAL_RATE / SENDER_PROCESSES
+SENDER_PROCESSES = 1
+
+LISTING_FIELDS = """
+    id, url, price, price_warm, size, address, lat, lon, created_at,
+    swapflat, wbs_required, source_immoscout, source_kleinanzeigen, source_immowelt, source_inberlinwohnen,
+    photo_url
+"""
 
 def calculate_distance(lat1, lon1, lat2, lon2):
     R = 6371000
@@ -36,208 +83,686 @@ def point_in_polygon(lat, lon, polygon):
         j = i
     return inside
 
-def parse_location(location_str):
-    if not location_str:
-        return None, None
-    if ';' in location_str:
-        points = location_str.split(';')
-        polygon = []
-        for p in points:
-            lat_str, lon_str = p.strip().split(',')
-            polygon.append((float(lat_str), float(lon_str)))
-        return ("polygon", polygon) if len(polygon) >= 3 else (None, None)
-    else:
-        parts = location_str.split(',')
-        if len(parts) == 3:
-            lat, lon, radius = map(lambda x: float(x.strip()), parts)
-            return "circle", (lat, lon, radius)
-        return None, None
-
-def send_matching_listings():
-    print("📬 Новые объявления найдены! Отправляем пользователям...")
-
-    conn = psycopg2.connect(**DB_CONFIG)
-    cursor = conn.cursor()
-
-    # Получаем дату последнего запуска
-    cursor.execute("SELECT value FROM run_metadata WHERE key = 'last_run'")
+def migrate_listings_created_at(cursor):
+    # created_at исторически TEXT с ISO-строкой; переводим в timestamptz с индексом под курсор
+    cursor.execute("""
+        SELECT data_type FROM information_schema.columns
+        WHERE table_name = 'listings' AND column_name = 'created_at'
+    """)
     row = cursor.fetchone()
-    MIN_CREATED_TIME = datetime.now(BERLIN_TZ) - timedelta(minutes=5) if not row else datetime.fromisoformat(row[0])
-
-    NOW = datetime.now(BERLIN_TZ)
+    if row and row[0] == "text":
+        cursor.execute("""
+            ALTER TABLE listings
+            ALTER COLUMN created_at TYPE TIMESTAMPTZ USING NULLIF(created_at, '')::timestamptz
+        """)
+        print("[DB] listings.created_at переведён в TIMESTAMPTZ")
+    cursor.execute("SELECT to_regclass('listings_created_at_id_idx')")
+    if cursor.fetchone()[0] is None:
+        cursor.execute("CREATE INDEX IF NOT EXISTS listings_created_at_id_idx ON listings (created_at, id)")
+
+def add_missing_column(cursor, table, column, definition):
+    # ALTER TABLE берёт эксклюзивную блокировку даже с IF NOT EXISTS — сначала смотрим в каталог
     cursor.execute("""
-        INSERT INTO run_metadata (key, value)
-        VALUES (%s, %s)
-        ON CONFLICT (key) DO UPDATE SET value = EXCLUDED.value
-    """, ('last_run', NOW.isoformat(timespec="seconds")))
-
-    # Получаем свежие объявления
+        SELECT 1 FROM information_schema.columns WHERE table_name = %s AND column_name = %s
+    """, (table, column))
+    if cursor.fetchone() is None:
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS {column} {definition}")
+
+def ensure_sender_schema(conn):
+    global schema_ready
+    if schema_ready:
+        return
+    cursor = conn.cursor()
+    # Блокировка до COMMIT в конце: параллельные старты ждут друг друга, а не ловят
+    # "tuple concurrently updated" и взаимные блокировки на DDL
+    cursor.execute("SELECT pg_advisory_xact_lock(%s)", (SCHEMA_LOCK_KEY,))
+    migrate_listings_created_at(cursor)
     cursor.execute("""
-        SELECT id, url, price, price_warm, size, address, lat, lon, created_at, 
-               swapflat, wbs_required, source_immoscout, source_kleinanzeigen, source_immowelt, source_inberlinwohnen,
-               photo_url
-        FROM listings
-        WHERE created_at >= %s
-        ORDER BY created_at DESC
-        LIMIT 100
-    """, (MIN_CREATED_TIME.isoformat(timespec="seconds"),))
-    listings = cursor.fetchall()
-    print(f"[DEBUG] Объявлений найдено: {len(listings)}")
-
-    # Получаем пользователей с включённым поиском
+        CREATE TABLE IF NOT EXISTS sent_listings (
+            user_id BIGINT,
+            listing_id TEXT,
+            url TEXT,
+            sent_at TEXT
+        )
+    """)
     cursor.execute("""
+        CREATE INDEX IF NOT EXISTS sent_listings_listing_user_idx
+        ON sent_listings (listing_id, user_id)
+    """)
+    ensure_outbox_schema(cursor)
+    ensure_photo_cache_schema(cursor)
+    # Колонки users, которые читает рассылка: telegram.create_users_table работает в другом процессе
+    # и может ещё не успеть их добавить (filters_version нужна и триггеру ниже)
+    add_missing_column(cursor, "users", "filters_version", "INTEGER DEFAULT 0")
+    add_missing_column(cursor, "users", "digest_mode", "INTEGER DEFAULT 0")
+    ensure_subscription_schema(cursor)
+    ensure_user_change_trigger(cursor)
+    conn.commit()
+    schema_ready = True
+
+def fetch_users(cursor, shard=None, user_ids=None):
+    # Только активные пользователи с действующей подпиской (частичный индекс по subscribed_until).
+    # shard = (номер, всего): процесс шардированной рассылки видит лишь user_id % всего == номер;
+    # user_ids — выборочно, для обновления общей таблицы фильтров (user_table)
+    ids = None if user_ids is None else list(user_ids)
+    cursor.execute(f"""
         SELECT id, location, min_price, max_price, min_size, max_size, 
                subscribed_until, is_searching,
                tauschwohnung, wbs,
-               use_immoscout, use_kleinanzeigen, use_immowelt, use_inberlinwohnen
+               use_immoscout, use_kleinanzeigen, use_immowelt, use_inberlinwohnen,
+               COALESCE(filters_version, 0)
         FROM users
-        WHERE COALESCE(is_searching, 0) = 1
-    """)
-    users = cursor.fetchall()
-    print(f"[DEBUG] Пользователей с is_searching=1: {len(users)}")
-
-    # Получаем уже отправленные объявления
-    cursor.execute("SELECT user_id, listing_id FROM sent_listings")
-    sent_records = set(cursor.fetchall())
+        WHERE is_searching = 1 AND {ACTIVE_SUBSCRIPTION_SQL}
+          AND (%s IS NULL OR mod(abs(id), %s) = %s)
+          AND (%s::bigint[] IS NULL OR id = ANY(%s))
+    """, (shard and shard[1], shard and shard[1], shard and shard[0], ids, ids))
+    return cursor.fetchall()
+
+def current_users(cursor, shard=None):
+    # Снимок общей таблицы фильтров, если она есть, иначе строки users из живого снимка процесса
+    if user_table is not None:
+        snapshot = user_table.snapshot(shard)
+        if snapshot is not None:
+            return snapshot
+    if shard not in live_users:
+        live_users[shard] = LiveUsers(fetch_users, shard)
+    return live_users[shard].users(cursor)
+
+def fetch_listings_by_ids(cursor, listing_ids):
+    cursor.execute(f"""
+        SELECT {LISTING_FIELDS}
+        FROM listings
+        WHERE id = ANY(%s)
+        ORDER BY created_at DESC
+    """, (list(listing_ids),))
+    return cursor.fetchall()
+
+def listings_cursor_key(shard):
+    # У каждого шарда свой курсор: шарды проходят одни и те же объявления независимо
+    return f"listings_cursor:{shard[0]}/{shard[1]}" if shard else "listings_cursor"
+
+def load_listings_cursor(cursor, shard=None):
+    key = listings_cursor_key(shard)
+    cursor.execute("SELECT key, value FROM run_metadata WHERE key IN (%s, 'listings_cursor', 'last_run')", (key,))
+    values = dict(cursor.fetchall())
+    for name in (key, "listings_cursor"):
+        if name in values:
+            created_at, listing_id = values[name].split("|", 1)
+            return datetime.fromisoformat(created_at), listing_id
+    # Первый запуск после миграции: продолжаем со старой отметки last_run
+    if "last_run" in values:
+        return datetime.fromisoformat(values["last_run"]), ""
+    return datetime.now(BERLIN_TZ) - timedelta(minutes=5), ""
+
+def save_listings_cursor(cursor, created_at, listing_id, shard=None):
+    cursor.execute("""
+        INSERT INTO run_metadata (key, value)
+        VALUES (%s, %s)
+        ON CONFLICT (key) DO UPDATE SET value = EXCLUDED.value
+    """, (listings_cursor_key(shard), f"{created_at.isoformat()}|{listing_id}"))
 
-    total_sent = 0
+def send_matching_listings(shard=None):
+    print("📬 Новые объявления найдены! Ставим совпадения в очередь доставки...")
 
+    conn = psycopg2.connect(**DB_CONFIG)
+    try:
+        ensure_sender_schema(conn)
+        cursor = conn.cursor()
+
+        expired = expire_subscriptions(cursor)
+        conn.commit()
+        if expired:
+            print(f"[SUBSCRIPTION] 🔕 Подписка истекла, поиск отключён: {len(expired)} польз.")
+
+        # Получаем пользователей с включённым поиском
+        users = current_users(cursor, shard)
+        print(f"[DEBUG] Пользователей с is_searching=1: {len(users)}")
+
+        # Листаем новые объявления курсором (created_at, id): каждое попадает ровно в одну страницу,
+        # курсор сохраняется в одной транзакции с постановкой в очередь.
+        # Самые свежие CURSOR_SAFETY_LAG секунд не берём — их вставки могут быть ещё не закоммичены.
+        last_created_at, last_id = load_listings_cursor(cursor, shard)
+        total_listings = total_queued = 0
+        while True:
+            cursor.execute("""
+                SELECT created_at, id
+                FROM listings
+                WHERE (created_at, id) > (%s, %s)
+                  AND created_at < now() - make_interval(secs => %s)
+                ORDER BY created_at, id
+                LIMIT %s
+            """, (last_created_at, last_id, CURSOR_SAFETY_LAG, LISTINGS_PAGE_SIZE))
+            page = cursor.fetchall()
+            if not page:
+                break
+
+            listings = fetch_listings_by_ids(cursor, [listing_id for _, listing_id in page])
+            total_queued += enqueue_matches(conn, cursor, listings, users, PRIORITY_CATCHUP)
+            total_listings += len(page)
+            last_created_at, last_id = page[-1]
+            save_listings_cursor(cursor, last_created_at, last_id, shard)
+            conn.commit()
+    finally:
+        conn.close()
+    print(f"[INFO] Сопоставление завершено: объявлений {total_listings}, в очередь доставки добавлено {total_queued}.")
+
+def catch_up(shard=None):
+    # Догоняющий проход с повторами: пока он не прошёл, объявления без уведомления никому не уйдут
+    delay = RETRY_INTERVAL
+    while True:
+        try:
+            send_matching_listings(shard)
+            return
+        except Exception as e:
+            print(f"[CATCHUP ERROR] {e}; повтор через {delay} сек")
+            time.sleep(delay)
+            delay = min(delay * 2, RETRY_INTERVAL_MAX)
+
+def advance_cursor(shard=None):
+    # Плановый проход курсором из run_pipeline / run_listener: совпадения уже в очереди или отправлены,
+    # так что проход лишь сдвигает курсор и подбирает объявления, чьи уведомления потерялись.
+    # Без повторов: при ошибке realtime не ждёт, следующий проход пройдёт и этот интервал
+    try:
+        send_matching_listings(shard)
+    except Exception as e:
+        print(f"[CATCHUP ERROR] {e}; повтор в следующем проходе")
+
+def prepare_users(users):
+    # Истёкшие подписки уже отсеяны в fetch_users; берём скомпилированные зоны поиска из кэша
+    filter_cache.retain(user[0] for user in users)
+    prepared = []
     for user in users:
+        user_id = user[0]
         try:
-            (user_id, location, min_price, max_price, min_size, max_size,
-             subscribed_until, is_searching,
-             tauschwohnung, wbs,
-             use_immoscout, use_kleinanzeigen, use_immowelt, use_inberlinwohnen) = user
-
-            if subscribed_until:
-                expiry = datetime.fromisoformat(subscribed_until).replace(tzinfo=BERLIN_TZ)
-                if expiry < datetime.now(BERLIN_TZ):
-                    cursor.execute("UPDATE users SET is_searching = 0 WHERE id = %s", (user_id,))
-                    conn.commit()
-                    print(f"[SUBSCRIPTION] 🔕 User {user_id} — подписка истекла, поиск отключён")
-                    continue
-
-            loc_type, loc_data = parse_location(location)
-            if loc_type is None:
+            compiled = filter_cache.get(user, user[14])
+            if compiled is None or compiled.loc_type is None:
                 continue
 
-            if loc_type == "circle":
-                lat_u, lon_u, radius_u = loc_data
-            else:
-                polygon = loc_data
+            prepared.append(compiled)
 
         except Exception as e:
             print(f"[USER ERROR] User {user_id}: {e}")
             continue
+    return prepared
+
+def matches_filters(user, listing):
+    (user_id, location, min_price, max_price, min_size, max_size,
+     subscribed_until, is_searching,
+     tauschwohnung, wbs,
+     use_immoscout, use_kleinanzeigen, use_immowelt, use_inberlinwohnen,
+     filters_version) = user
+    (listing_id, url, price, price_warm, size, address, lat_l, lon_l,
+     created_at, swapflat, wbs_required,
+     source_immoscout, source_kleinanzeigen, source_immowelt, source_inberlinwohnen,
+     photo_url) = listing
+
+    if source_immoscout and not use_immoscout:
+        return False
+    if source_kleinanzeigen and not use_kleinanzeigen:
+        return False
+    if source_immowelt and not use_immowelt:
+        return False
+    if source_inberlinwohnen and not use_inberlinwohnen:
+        return False
+    if tauschwohnung == 0 and swapflat == 1:
+        return False
+    if wbs == 0 and wbs_required == 1:
+        return False
+
+    if min_price is not None and price < min_price:
+        return False
+    if max_price is not None and price > max_price:
+        return False
+    if min_size is not None and size < min_size:
+        return False
+    if max_size is not None and size > max_size:
+        return False
+    return True
+
+def listing_photos(listing):
+    photo_url = listing[15]
+    return [u.strip() for u in (photo_url or '').split(',') if u.strip()][:10]
+
+def listing_source(listing):
+    source_immoscout, source_kleinanzeigen, source_immowelt, source_inberlinwohnen = listing[11:15]
+    return (
+        "ImmobilienScout24" if source_immoscout else
+        "Immowelt" if source_immowelt else
+        "Kleinanzeigen" if source_kleinanzeigen else
+        "InBerlinWohnen" if source_inberlinwohnen else
+        "Listing"
+    )
+
+def render_message(listing):
+    (listing_id, url, price, price_warm, size, address, lat_l, lon_l,
+     created_at, swapflat, wbs_required,
+     source_immoscout, source_kleinanzeigen, source_immowelt, source_inberlinwohnen,
+     photo_url) = listing
+
+    source_str = listing_source(listing)
+
+    address_encoded = quote_plus(address)
+    google_maps_url = f"https://www.google.com/maps/search/?api=1&query={address_encoded}"
+    url_encoded = quote(url, safe=":/")
+
+    if price_warm is None or price_warm == 0:
+        price_text = f"💰 <b>Price:</b> {price} €"
+    elif price_warm == price:
+        price_text = f"💰 <b>Price:</b> {price} €"
+    elif price_warm > price:
+        price_text = f"💰 <b>Kaltmiete:</b> {price} € | <b>Warmmiete:</b> {price_warm} €"
+    else:
+        price_text = f"💰 <b>Price:</b> {price} €"
+
+    return (
+        f"🏠 <b>New Flat for You!</b>\n"
+        f"{price_text}\n"
+        f"📏 <b>Size:</b> {size} m²\n"
+        f"🔗 <a href='{url_encoded}'>{source_str} Link</a>\n"
+        f"📍 <a href='{google_maps_url}'>{address}</a>"
+    )
+
+class ListingRenderer:
+    # Кэш на один запуск рассылки: подпись и payload собираются один раз на объявление
+    # и язык, а все получатели делят один и тот же объект (движок его не изменяет).
+    # Подписи пока только на английском, поэтому всем пользователям достаётся ключ "en".
+    def __init__(self):
+        self.payloads = {}
+
+    def payload(self, listing, lang="en", file_ids=None):
+        photo_urls = listing_photos(listing)
+        if file_ids and len(file_ids) == len(photo_urls):
+            photo_urls = file_ids
+        key = (listing[0], lang, photo_urls is file_ids)
+        cached = self.payloads.get(key)
+        if cached is None:
+            message = render_message(listing)
+            if photo_urls:
+                cached = ("sendMediaGroup", {"media": [{
+                    "type": "photo",
+                    "media": img_url,
+                    "caption": message if i == 0 else "",
+                    "parse_mode": "HTML"
+                } for i, img_url in enumerate(photo_urls)]})
+            else:
+                cached = ("sendMessage", {"text": message, "parse_mode": "HTML"})
+            self.payloads[key] = cached
+        return cached
+
+    def job(self, user_id, listing, lang="en", file_ids=None):
+        method, payload = self.payload(listing, lang, file_ids)
+        return DeliveryJob(user_id, method, payload, listing)
+
+def render_digest(listings):
+    # Компактный список без фото: одна строка на объявление
+    lines = [f"🏠 <b>{len(listings)} New Flats for You!</b>"]
+    for listing in listings:
+        url, price, price_warm, size, address = listing[1:6]
+        price_text = f"{price} €" if not price_warm or price_warm <= price else f"{price} € / {price_warm} € warm"
+        maps_url = f"https://www.google.com/maps/search/?api=1&query={quote_plus(address)}"
+        lines.append(
+            f"• {price_text} · {size} m² · <a href='{quote(url, safe=':/')}'>{listing_source(listing)}</a>"
+            f" · <a href='{maps_url}'>{address}</a>"
+        )
+    return "\n".join(lines)
+
+def digest_jobs(user_id, entries):
+    # entries: [(outbox_id, listing)] → сообщения по DIGEST_MAX_ITEMS объявлений
+    jobs = []
+    for start in range(0, len(entries), DIGEST_MAX_ITEMS):
+        chunk = entries[start:start + DIGEST_MAX_ITEMS]
+        jobs.append(DeliveryJob(user_id, "sendMessage", {
+            "text": render_digest([listing for _, listing in chunk]),
+            "parse_mode": "HTML",
+            "disable_web_page_preview": True
+        }, chunk))
+    return jobs
+
+def load_digest_users(cursor, user_ids):
+    if not user_ids:
+        return set()
+    cursor.execute("SELECT id FROM users WHERE id = ANY(%s) AND digest_mode = 1", (list(user_ids),))
+    return {row[0] for row in cursor.fetchall()}
+
+def benchmark_rendering(recipients=500, rounds=20):
+    listing = ("123456", "https://www.immobilienscout24.de/expose/123456", 1150.0, 1420.0, 62.5,
+               "Sonnenallee 1, 12047 Berlin", 52.49, 13.43, "now", 0, 0, 1, 0, 0, 0,
+               ",".join(f"https://pictures.immobilienscout24.de/listings/{i}.jpg" for i in range(5)))
+
+    started = time.perf_counter()
+    for _ in range(rounds):
+        for user_id in range(recipients):
+            ListingRenderer().job(user_id, listing)
+    per_user = (time.perf_counter() - started) / rounds
+
+    started = time.perf_counter()
+    for _ in range(rounds):
+        renderer = ListingRenderer()
+        for user_id in range(recipients):
+            renderer.job(user_id, listing)
+    cached = (time.perf_counter() - started) / rounds
+
+    print(f"1 объявление → {recipients} получателей: без кэша {per_user * 1000:.2f} мс, "
+          f"с кэшем {cached * 1000:.2f} мс (×{per_user / max(cached, 1e-9):.1f})")
+
+def find_matches(prepared, listings):
+    # Пары (ключ пользователя в prepared, позиция объявления в listings)
+    if MATCH_ENGINE == "numpy":
+        from vector_match import match_pairs
+        yield from match_pairs(prepared, listings)
+        return
+
+    # Сетка кешируется в filter_cache; её ключи — user_id, а строки пользователей берутся из prepared
+    index = filter_cache.spatial_index(prepared)
+    keys = {compiled.user_id: key for key, compiled in enumerate(prepared)}
+    for pos, listing in enumerate(listings):
+        price, size, lat_l, lon_l, created_at = listing[2], listing[4], listing[6], listing[7], listing[8]
+        if None in (price, size, lat_l, lon_l, created_at):
+            continue
 
-        for listing in listings:
+        # Точная проверка зоны — только для пользователей, чей bbox содержит точку
+        for user_id in index.candidates(lat_l, lon_l):
+            key = keys[user_id]
+            compiled = prepared[key]
             try:
-                (listing_id, url, price, price_warm, size, address, lat_l, lon_l,
-                 created_at, swapflat, wbs_required,
-                 source_immoscout, source_kleinanzeigen, source_immowelt, source_inberlinwohnen,
-                 photo_url) = listing
-
-                if (user_id, listing_id) in sent_records:
-                    continue
-                if None in (price, size, lat_l, lon_l, created_at):
-                    continue
-
-                if source_immoscout and not use_immoscout:
-                    continue
-                if source_kleinanzeigen and not use_kleinanzeigen:
-                    continue
-                if source_immowelt and not use_immowelt:
-                    continue
-                if source_inberlinwohnen and not use_inberlinwohnen:
-                    continue
-                if tauschwohnung == 0 and swapflat == 1:
-                    continue
-                if wbs == 0 and wbs_required == 1:
-                    continue
-
-                if min_price is not None and price < min_price:
-                    continue
-                if max_price is not None and price > max_price:
-                    continue
-                if min_size is not None and size < min_size:
-                    continue
-                if max_size is not None and size > max_size:
-                    continue
-
-                if loc_type == "circle":
-                    if calculate_distance(lat_u, lon_u, lat_l, lon_l) > radius_u:
-                        continue
-                else:
-                    if not point_in_polygon(lat_l, lon_l, polygon):
-                        continue
-
-                source_str = (
-                    "ImmobilienScout24" if source_immoscout else
-                    "Immowelt" if source_immowelt else
-                    "Kleinanzeigen" if source_kleinanzeigen else
-                    "InBerlinWohnen" if source_inberlinwohnen else
-                    "Listing"
-                )
-
-                address_encoded = quote_plus(address)
-                google_maps_url = f"https://www.google.com/maps/search/?api=1&query={address_encoded}"
-                url_encoded = quote(url, safe=":/")
-
-                if price_warm is None or price_warm == 0:
-                    price_text = f"💰 <b>Price:</b> {price} €"
-                elif price_warm == price:
-                    price_text = f"💰 <b>Price:</b> {price} €"
-                elif price_warm > price:
-                    price_text = f"💰 <b>Kaltmiete:</b> {price} € | <b>Warmmiete:</b> {price_warm} €"
-                else:
-                    price_text = f"💰 <b>Price:</b> {price} €"
-
-                message = (
-                    f"🏠 <b>New Flat for You!</b>\n"
-                    f"{price_text}\n"
-                    f"📏 <b>Size:</b> {size} m²\n"
-                    f"🔗 <a href='{url_encoded}'>{source_str} Link</a>\n"
-                    f"📍 <a href='{google_maps_url}'>{address}</a>"
-                )
-
-                photo_urls = [u.strip() for u in (photo_url or '').split(',') if u.strip()]
-
-                if photo_urls:
-                    media = [{
-                        "type": "photo",
-                        "media": img_url,
-                        "caption": message if i == 0 else "",
-                        "parse_mode": "HTML"
-                    } for i, img_url in enumerate(photo_urls[:10])]
-                    response = requests.post(TELEGRAM_MEDIA_GROUP_URL, json={
-                        "chat_id": user_id,
-                        "media": media
-                    })
-                else:
-                    response = requests.post(TELEGRAM_API_URL, json={
-                        "chat_id": user_id,
-                        "text": message,
-                        "parse_mode": "HTML"
-                    })
-
-                if response.status_code == 200:
-                    total_sent += 1
-                    cursor.execute(
-                        "INSERT INTO sent_listings (user_id, listing_id, url, sent_at) VALUES (%s, %s, %s, %s)",
-                        (user_id, listing_id, url, datetime.now(BERLIN_TZ).isoformat(timespec="seconds"))
-                    )
-                    conn.commit()
-                else:
-                    print(f"❌ Ошибка отправки пользователю {user_id}: {response.status_code}, {response.text}")
+                if matches_filters(compiled.user, listing) and compiled.contains(lat_l, lon_l):
+                    yield key, pos
             except Exception as e:
                 print(f"[ERROR] Внутри цикла listings: {e}")
-                continue
 
-    conn.close()
-    print(f"[INFO] Завершено: Отправлено {total_sent} новых объявлений.")
+def enqueue_matches(conn, cursor, listings, users, priority):
+    # Уже отправленные пары отсекает сам INSERT в outbox.enqueue
+    if isinstance(users, list):
+        prepared = prepare_users(users)
+        matched = ((prepared[key].user_id, pos) for key, pos in find_matches(prepared, listings))
+    else:
+        matched = users.match(listings)  # user_table.UserSnapshot
+
+    pairs = [(user_id, listings[pos][0]) for user_id, pos in matched]
+    return enqueue(cursor, pairs, priority)
+
+def listing_age(listing):
+    # Секунды с момента, когда скрапер сохранил объявление
+    if listing is None or listing[8] is None:
+        return float("inf")
+    return (datetime.now(BERLIN_TZ) - listing[8]).total_seconds()
+
+def drain_outbox(conn, limit=OUTBOX_BATCH, shard=None):
+    # Забирает пачку из delivery_outbox, отправляет и отмечает результат; возвращает размер пачки
+    cursor = conn.cursor()
+    claimed = claim(cursor, limit, shard)
+    claimed_count = len(claimed)
+    claimed = drop_sent(cursor, claimed)
+    conn.commit()
+    if not claimed:
+        return claimed_count
+
+    listings = {listing[0]: listing for listing in fetch_listings_by_ids(cursor, {row[2] for row in claimed})}
+    file_ids = load_file_ids(cursor, listings)
+
+    pending_per_user = {}
+    for row in claimed:
+        pending_per_user[row[1]] = pending_per_user.get(row[1], 0) + 1
+    digest_users = load_digest_users(
+        cursor, [user_id for user_id, count in pending_per_user.items() if count > DIGEST_THRESHOLD])
+
+    # Самые свежие объявления — первыми; пользователи чередуются по кругу (interleave_by_chat)
+    newest_first = sorted(claimed, key=lambda row: listing_age(listings.get(row[2])))
+
+    # Фото нового объявления загружает только первая отправка; остальные получатели этого объявления
+    # ждут её результата (uploads) и уходят с file_id, не дожидаясь чужих отправок
+    entries, rejected, failed = [], [], []
+    digests = {}
+    uploads = {}  # listing_id → asyncio.Event: первая отправка с фото завершилась
+    for outbox_id, user_id, listing_id, attempts in newest_first:
+        listing = listings.get(listing_id)
+        if listing is None:
+            rejected.append(outbox_id)  # объявление уже удалено очисткой
+            continue
+        if user_id in digest_users:
+            digests.setdefault(user_id, []).append((outbox_id, listing))
+            continue
+        waits_upload = False
+        if listing_id not in file_ids and listing_photos(listing):
+            waits_upload = listing_id in uploads
+            uploads.setdefault(listing_id, asyncio.Event())
+        entries.append((outbox_id, user_id, listing, waits_upload))
+
+    sent_buffer = SentBuffer(conn)
+    latencies = {}
+
+    def on_result(job, status, data):
+        try:
+            record_result(job, status, data)
+        finally:
+            # Успех или нет — ожидающие получатели объявления больше не ждут (без file_id загрузят сами)
+            upload = uploads.get(job.context[0][1][0]) if job.method == "sendMediaGroup" else None
+            if upload is not None:
+                upload.set()
+
+    def record_result(job, status, data):
+        # context — [(outbox_id, listing)]: одно объявление или весь дайджест
+        if status == 200:
+            if job.method == "sendMediaGroup":
+                listing = job.context[0][1]
+                if listing[0] not in file_ids:
+                    uploaded = extract_file_ids(data)
+                    if uploaded:
+                        file_ids[listing[0]] = uploaded
+                        store_file_ids(cursor, listing[0], uploaded)
+            for outbox_id, listing in job.context:
+                sent_buffer.add(job.chat_id, listing[0], listing[1], outbox_id)
+                latencies.setdefault(job.chat_id, []).append(listing_age(listing))
+            return
+        print(f"❌ Ошибка отправки пользователю {job.chat_id}: {status}, {data}")
+        # 400/403 — бот заблокирован или сообщение некорректно, повтор не поможет
+        (rejected if status in (400, 403) else failed).extend(outbox_id for outbox_id, _ in job.context)
+
+    renderer = ListingRenderer()
+
+    async def after_upload(job):
+        listing = job.context[0][1]
+        await uploads[listing[0]].wait()
+        job.method, job.payload = renderer.payload(listing, file_ids=file_ids.get(listing[0]))
+
+    jobs = []
+    for outbox_id, user_id, listing, waits_upload in entries:
+        try:
+            job = renderer.job(user_id, listing, file_ids=file_ids.get(listing[0]))
+        except Exception as e:
+            print(f"[ERROR] Подготовка сообщения {listing[0]} для {user_id}: {e}")
+            rejected.append(outbox_id)
+            if not waits_upload and listing[0] in uploads:
+                uploads[listing[0]].set()
+            continue
+        job.context = [(outbox_id, listing)]
+        if waits_upload:
+            job.ready = after_upload
+        jobs.append(job)
+    for user_id, digest_entries in digests.items():
+        jobs.extend(digest_jobs(user_id, digest_entries))
+
+    heartbeat = {"at": time.monotonic()}
+
+    def on_tick():
+        sent_buffer.flush_if_due()
+        if time.monotonic() - heartbeat["at"] >= CLAIM_HEARTBEAT:
+            heartbeat["at"] = time.monotonic()
+            extend_claim(cursor, [row[0] for row in claimed])
+            conn.commit()
+
+    try:
+        delivery_engine.deliver(interleave_by_chat(jobs), on_result, on_tick=on_tick)
+    finally:
+        sent_buffer.flush()
+        drop(cursor, rejected)
+        release(cursor, failed)
+        conn.commit()
+    print(f"[OUTBOX] Отправлено {sent_buffer.flushed} из {len(claimed)}")
+    print(f"[LATENCY] От появления до доставки: {latency_report(latencies)}")
+    return claimed_count
 
 def run():
     send_matching_listings()
+    conn = psycopg2.connect(**DB_CONFIG)
+    try:
+        while drain_outbox(conn):
+            pass
+    finally:
+        conn.close()
+
+def set_sender_processes(count):
+    global SENDER_PROCESSES, delivery_engine
+    SENDER_PROCESSES = max(1, count)
+    delivery_engine = DeliveryEngine(global_rate=GLOBAL_RATE / SENDER_PROCESSES)
+    print(f"[DELIVERY] Процессов рассылки: {SENDER_PROCESSES}, лимит на процесс {GLOBAL_RATE / SENDER_PROCESSES:.1f} сообщ./с")
+
+def senders_from_argv(argv, default=1):
+    # "--senders N": общее число процессов рассылки, делящих лимит бота
+    if "--senders" in argv:
+        return int(argv[argv.index("--senders") + 1])
+    return default
+
+def run_drain_worker(shard=None):
+    # Воркер доставки: можно запускать несколько процессов — строки делятся через SKIP LOCKED
+    listen_conn = None
+    conn = None
+    while True:
+        try:
+            if listen_conn is None or listen_conn.closed:
+                listen_conn = psycopg2.connect(**DB_CONFIG)
+                listen_conn.autocommit = True
+                listen_conn.cursor().execute(f"LISTEN {OUTBOX_CHANNEL}")
+            if conn is None or conn.closed:
+                conn = psycopg2.connect(**DB_CONFIG)
+                ensure_sender_schema(conn)
+
+            if drain_outbox(conn, shard=shard):
+                continue
+
+            select.select([listen_conn], [], [], DRAIN_POLL_INTERVAL)
+            listen_conn.poll()
+            listen_conn.notifies.clear()
+        except Exception as e:
+            print(f"[OUTBOX ERROR] {e}")
+            for c in (listen_conn, conn):
+                if c is not None:
+                    c.close()
+            listen_conn = conn = None
+            time.sleep(DRAIN_POLL_INTERVAL)
+
+def process_listing_batch(conn, batch, label, shard=None):
+    # batch: {listing_id: время появления}; возвращает (соединение для следующего пакета, успех).
+    # Неудачный пакет вызывающий оставляет у себя и повторяет вместе со следующими id
+    try:
+        if conn is None or conn.closed:
+            conn = psycopg2.connect(**DB_CONFIG)
+            ensure_sender_schema(conn)
+        cursor = conn.cursor()
+        listings = fetch_listings_by_ids(cursor, batch)
+        users = current_users(cursor, shard)
+        queued = enqueue_matches(conn, cursor, listings, users, PRIORITY_REALTIME)
+        conn.commit()
+        delay = time.time() - min(batch.values())
+        print(f"[{label}] {len(listings)} объявл. → в очередь {queued}, задержка {delay:.1f} сек")
+    except Exception as e:
+        print(f"[{label} ERROR] {e}; пакет из {len(batch)} объявл. будет повторён")
+        if conn is not None:
+            conn.close()
+        return None, False
+    return conn, True
+
+def run_pipeline(events=new_listings):
+    # Долгоживущий режим: объявления приходят из очереди сразу после сохранения скрапером.
+    # При старте догоняем всё, что появилось, пока отправитель не работал.
+    local_delivery.set()
+    catch_up()
+    last_pass = time.time()
+
+    conn = None
+    batch = {}
+    retry_delay = RETRY_INTERVAL
+    while True:
+        if time.time() - last_pass >= CURSOR_PASS_INTERVAL:
+            advance_cursor()
+            last_pass = time.time()
+        if batch:
+            # Предыдущий пакет не прошёл: копим новые id до повтора
+            deadline = time.time() + retry_delay
+        else:
+            try:
+                listing_id, queued_at = events.get(timeout=max(0, last_pass + CURSOR_PASS_INTERVAL - time.time()))
+            except queue.Empty:
+                continue
+            batch[listing_id] = queued_at
+            deadline = time.time() + PIPELINE_BATCH_WINDOW
+        while (remaining := deadline - time.time()) > 0:
+            try:
+                listing_id, queued_at = events.get(timeout=remaining)
+            except queue.Empty:
+                break
+            batch.setdefault(listing_id, queued_at)
+
+        conn, ok = process_listing_batch(conn, batch, "PIPELINE")
+        if ok:
+            batch = {}
+            retry_delay = RETRY_INTERVAL
+        else:
+            retry_delay = min(retry_delay * 2, RETRY_INTERVAL_MAX)
+
+def run_listener(shard=None):
+    # Отдельный процесс сопоставления: просыпается по NOTIFY из scraper_core.ListingWriter и
+    # ставит в очередь доставки ровно те id, что пришли в уведомлениях.
+    # Рассылают воркеры доставки (--drain); дубли отсекает UNIQUE в delivery_outbox.
+    listen_conn = None
+    conn = None
+    batch = {}  # накопленные id; после ошибки сопоставления повторяются вместе со следующими
+    last_pass = 0.0
+    while True:
+        try:
+            if listen_conn is None or listen_conn.closed:
+                listen_conn = psycopg2.connect(**DB_CONFIG)
+                listen_conn.autocommit = True
+                listen_conn.cursor().execute(f"LISTEN {LISTING_CHANNEL}")
+                # NOTIFY, отправленные пока соединения не было, потеряны — после каждого (пере)подключения
+                # догоняем курсором; LISTEN уже активен, так что новое не проскочит между ними
+                catch_up(shard)
+                last_pass = time.time()
+                print(f"[LISTEN] Ожидание уведомлений в канале '{LISTING_CHANNEL}'...")
+
+            if select.select([listen_conn], [], [], LISTEN_POLL_TIMEOUT) != ([], [], []):
+                deadline = time.time() + PIPELINE_BATCH_WINDOW
+                while True:
+                    listen_conn.poll()
+                    while listen_conn.notifies:
+                        notification = listen_conn.notifies.pop(0)
+                        batch.setdefault(notification.payload, time.time())
+                    remaining = deadline - time.time()
+                    if remaining <= 0 or select.select([listen_conn], [], [], remaining) == ([], [], []):
+                        break
+        except Exception as e:
+            print(f"[LISTEN ERROR] {e}")
+            if listen_conn is not None:
+                listen_conn.close()
+            listen_conn = None
+            time.sleep(LISTEN_POLL_TIMEOUT)
+            continue
+
+        if batch:
+            conn, ok = process_listing_batch(conn, batch, "LISTEN", shard)
+            if ok:
+                batch = {}
+        if time.time() - last_pass >= CURSOR_PASS_INTERVAL:
+            advance_cursor(shard)
+            last_pass = time.time()
 
 if __name__ == "__main__":
-    run()
+    if "--listen" in sys.argv[1:]:
+        run_listener()
+    elif "--drain" in sys.argv[1:]:
+        set_sender_processes(senders_from_argv(sys.argv))
+        run_drain_worker()
+    elif "--bench-render" in sys.argv[1:]:
+        benchmark_rendering()
+    else:
+        run()
@@ -0,0 +1,65 @@
+import os
+import sys
+import types
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Тестовая БД задаётся только через AUTOWOHNBOT_TEST_DSN; тесты, которым она нужна, без неё пропускаются.
+# config.py с боевыми секретами тесты не читают никогда — модуль подменяется тестовыми настройками.
+TEST_DSN = os.environ.get("AUTOWOHNBOT_TEST_DSN")
+
+config = types.ModuleType("config")
+config.DB_CONFIG = {"dsn": TEST_DSN or ""}
+config.BOT_TOKEN = config.TOKEN = "123456:test"
+config.ADMIN_ID = 0
+sys.modules["config"] = config
+
+
+def query(sql, params=None):
+    import psycopg2
+
+    conn = psycopg2.connect(TEST_DSN)
+    conn.autocommit = True
+    try:
+        cursor = conn.cursor()
+        cursor.execute(sql, params)
+        return cursor.fetchall() if cursor.description else None
+    finally:
+        conn.close()
+
+
+def create_test_schema(users):
+    # Чистая схема рассылки в тестовой БД; users: [(id, location)] — все с включённым поиском
+    import psycopg2
+    import scraper_core
+    import telegram_sender
+
+    for table in ("delivery_outbox", "sent_listings", "listing_photo_cache", "run_metadata", "listings", "users"):
+        query(f"DROP TABLE IF EXISTS {table} CASCADE")
+    query("""
+        CREATE TABLE users (
+            id BIGINT PRIMARY KEY, location TEXT,
+            min_price INTEGER, max_price INTEGER, min_size INTEGER, max_size INTEGER,
+            tauschwohnung INTEGER DEFAULT 0, wbs INTEGER DEFAULT 0,
+            use_immoscout INTEGER DEFAULT 1, use_kleinanzeigen INTEGER DEFAULT 1,
+            use_immowelt INTEGER DEFAULT 1, use_inberlinwohnen INTEGER DEFAULT 1,
+            subscribed_until TIMESTAMP, is_searching INTEGER DEFAULT 0
+        )
+    """)
+    query("CREATE TABLE run_metadata (key TEXT PRIMARY KEY, value TEXT)")
+    for user_id, location in users:
+        query("INSERT INTO users (id, location, is_searching) VALUES (%s, %s, 1)", (user_id, location))
+
+    scraper_core._schema_ready = False
+    scraper_core.init_db()
+    telegram_sender.schema_ready = False
+    telegram_sender.live_users.clear()
+    conn = psycopg2.connect(TEST_DSN)
+    telegram_sender.ensure_sender_schema(conn)
+    conn.close()
+
+
+def test_listing(lat=52.52, lon=13.405, photos=0):
+    return {"url": "https://example.org", "price": 900.0, "price_warm": 1100.0, "size": 50.0,
+            "address": "Teststraße 1, 10115 Berlin", "lat": lat, "lon": lon,
+            "photo_url": ",".join(f"https://example.org/{i}.jpg" for i in range(photos))}
@@ -0,0 +1,81 @@
+import asyncio
+import time
+
+from aiohttp import web
+
+# Поддельный Bot API для проверки delivery.DeliveryEngine: принимает sendMessage/sendMediaGroup,
+# записывает каждый запрос и, как Telegram, отвечает 429 с retry_after при превышении лимитов —
+# общего (токены по числу сообщений, альбом = число фото) и 1 сообщение/с в чат.
+TOKEN = "123456:test"
+CLOCK_SLACK = 0.05  # сек: допуск на разницу часов клиента и сервера
+
+
+class FakeBotApi:
+    def __init__(self, global_rate=30, chat_interval=1.0, latency=0.02):
+        self.global_rate = global_rate
+        self.chat_interval = chat_interval
+        self.latency = latency
+        self.tokens = global_rate
+        self.updated = time.monotonic()
+        self.last_by_chat = {}
+        self.requests = []     # (время, chat_id, метод, payload) — только принятые
+        self.violations = []   # (время, chat_id, причина) — ответы 429 из-за превышения лимита
+        self.fail_next = {}    # chat_id → сколько следующих запросов отклонить с 429 (имитация)
+        self.runner = None
+        self.base_url = None
+
+    def _global_allows(self, cost, now):
+        self.tokens = min(self.global_rate, self.tokens + (now - self.updated) * self.global_rate)
+        self.updated = now
+        if self.tokens + CLOCK_SLACK * self.global_rate < cost:
+            return False
+        self.tokens -= cost
+        return True
+
+    async def handle(self, request):
+        body = await request.json()
+        chat_id = body["chat_id"]
+        now = time.monotonic()
+
+        if self.fail_next.get(chat_id):
+            self.fail_next[chat_id] -= 1
+            return self._too_many(1)
+
+        last = self.last_by_chat.get(chat_id)
+        if last is not None and now - last < self.chat_interval - CLOCK_SLACK:
+            self.violations.append((now, chat_id, "chat"))
+            return self._too_many(1)
+        if not self._global_allows(len(body.get("media", ())) or 1, now):
+            self.violations.append((now, chat_id, "global"))
+            return self._too_many(1)
+
+        self.last_by_chat[chat_id] = now
+        self.requests.append((now, chat_id, request.match_info["method"], body))
+        await asyncio.sleep(self.latency)
+        if request.match_info["method"] == "sendMediaGroup":
+            result = [{"photo": [{"file_id": f"file-{chat_id}-{i}"}]} for i, _ in enumerate(body["media"])]
+        else:
+            result = {"message_id": len(self.requests)}
+        return web.json_response({"ok": True, "result": result})
+
+    @staticmethod
+    def _too_many(retry_after):
+        return web.json_response({"ok": False, "error_code": 429, "parameters": {"retry_after": retry_after}},
+                                 status=429)
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_post(f"/bot{TOKEN}/{{method}}", self.handle)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.base_url = f"http://127.0.0.1:{port}"
+        return self.base_url
+
+    async def stop(self):
+        await self.runner.cleanup()
+
+    def texts(self):
+        return [body.get("text") or body["media"][0]["caption"] for _, _, _, body in self.requests]
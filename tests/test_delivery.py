@@ -0,0 +1,80 @@
+import asyncio
+import time
+
+import pytest
+
+pytest.importorskip("aiohttp")
+
+from delivery import DeliveryEngine, DeliveryJob, interleave_by_chat
+from fake_bot_api import TOKEN, FakeBotApi
+
+
+def text_job(chat_id, text):
+    return DeliveryJob(chat_id, "sendMessage", {"text": text})
+
+
+def album_job(chat_id, caption, photos=5):
+    return DeliveryJob(chat_id, "sendMediaGroup", {"media": [
+        {"type": "photo", "media": f"https://example.org/{i}.jpg", "caption": caption if i == 0 else ""}
+        for i in range(photos)
+    ]})
+
+
+def deliver(jobs, global_rate=30, api=None):
+    api = api or FakeBotApi(global_rate=global_rate)
+    results = []
+
+    async def scenario():
+        engine = DeliveryEngine(token=TOKEN, api_base=await api.start(), global_rate=global_rate)
+        try:
+            started = time.monotonic()
+            await engine.run(jobs, lambda job, status, data: results.append((job.chat_id, status)))
+            return time.monotonic() - started
+        finally:
+            await api.stop()
+
+    return api, results, asyncio.run(scenario())
+
+
+def test_album_is_not_starved_by_later_text_jobs():
+    # Бакет выбран первыми 20 сообщениями; альбом (5 токенов) стоит перед ещё 40 одиночными
+    jobs = [text_job(chat_id, f"t{chat_id}") for chat_id in range(1, 21)]
+    jobs.append(album_job(100, "album"))
+    jobs.extend(text_job(chat_id, f"t{chat_id}") for chat_id in range(21, 61))
+    api, results, _ = deliver(jobs, global_rate=10)
+
+    assert all(status == 200 for _, status in results)
+    assert not api.violations
+    sent = api.texts()
+    assert sent.index("album") == 20
+    # После альбома — строго в порядке постановки
+    assert sent[21:] == [f"t{chat_id}" for chat_id in range(21, 61)]
+
+
+def test_rate_limits_and_retry_after():
+    api = FakeBotApi(global_rate=30)
+    api.fail_next[1] = 1  # первый запрос в чат 1 получает 429
+    jobs = [text_job(chat_id, f"t{chat_id}") for chat_id in range(1, 91)]
+    jobs.extend(text_job(1, f"extra{i}") for i in range(4))
+    api, results, elapsed = deliver(jobs, global_rate=30, api=api)
+
+    assert len(results) == 94 and all(status == 200 for _, status in results)
+    assert not api.violations
+    # 94 сообщения при 30/с и бакете на 30: не быстрее ~2 с, пятое сообщение в чат 1 — не раньше ~5 с
+    assert elapsed >= 2.0
+    chat_1 = [sent_at for sent_at, chat_id, _, _ in api.requests if chat_id == 1]
+    assert len(chat_1) == 5 and all(b - a >= 0.95 for a, b in zip(chat_1, chat_1[1:]))
+
+
+def test_round_robin_order_is_kept_under_global_limit():
+    # Пользователь 1 с тремя объявлениями стоит первым: после interleave_by_chat его второе и третье
+    # сообщения уходят только после всех остальных чатов, а не вклиниваются, когда освободится токен
+    jobs = [text_job(1, f"u1-{i}") for i in range(3)]
+    jobs.extend(text_job(chat_id, f"t{chat_id}") for chat_id in range(2, 31))
+    ordered = interleave_by_chat(jobs)
+    api, results, _ = deliver(ordered, global_rate=10)
+
+    assert all(status == 200 for _, status in results)
+    assert not api.violations
+    assert api.texts() == [job.payload["text"] for job in ordered]
+    assert api.texts()[:2] == ["u1-0", "t2"] and api.texts()[-2:] == ["u1-1", "u1-2"]
@@ -0,0 +1,109 @@
+import asyncio
+import threading
+
+import pytest
+
+from conftest import TEST_DSN, create_test_schema, query, test_listing as listing
+
+psycopg2 = pytest.importorskip("psycopg2")
+pytest.importorskip("aiohttp")
+pytestmark = pytest.mark.skipif(not TEST_DSN, reason="AUTOWOHNBOT_TEST_DSN не задан")
+
+from delivery import DeliveryEngine
+from fake_bot_api import TOKEN, FakeBotApi
+
+BERLIN = "52.52,13.405,5000"
+
+
+@pytest.fixture
+def bot_api():
+    # Сервер крутится в своём потоке: drain_outbox сам запускает цикл событий через asyncio.run
+    api = FakeBotApi()
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    base_url = asyncio.run_coroutine_threadsafe(api.start(), loop).result()
+    yield api, base_url
+    asyncio.run_coroutine_threadsafe(api.stop(), loop).result()
+    loop.call_soon_threadsafe(loop.stop)
+
+
+def test_waiting_recipients_start_right_after_upload(bot_api, monkeypatch):
+    api, base_url = bot_api
+    create_test_schema([(user_id, BERLIN) for user_id in (1, 2, 3, 4, 9)])
+
+    import outbox
+    import scraper_core
+    import telegram_sender
+    monkeypatch.setattr(telegram_sender, "delivery_engine", DeliveryEngine(token=TOKEN, api_base=base_url))
+
+    with scraper_core.ListingWriter("immoscout", notify_new=False) as writer:
+        writer.add("album", listing(photos=3))
+        for i in range(3):
+            writer.add(f"text-{i}", listing())
+
+    # Чат 9 получает три текста подряд (~2 с при 1 сообщении/с) — получатели альбома не должны их ждать
+    conn = psycopg2.connect(TEST_DSN)
+    cursor = conn.cursor()
+    outbox.enqueue(cursor, [(user_id, "album") for user_id in (1, 2, 3, 4)])
+    outbox.enqueue(cursor, [(9, f"text-{i}") for i in range(3)])
+    conn.commit()
+    try:
+        assert telegram_sender.drain_outbox(conn) == 7
+    finally:
+        conn.close()
+
+    albums = [(sent_at, body) for sent_at, _, method, body in api.requests if method == "sendMediaGroup"]
+    assert len(albums) == 4 and not api.violations
+    upload_at, upload = albums[0]
+    assert upload["media"][0]["media"].startswith("https://")
+    # Остальные ушли с file_id первой загрузки, сразу после неё, а не после всей первой волны
+    assert all(body["media"][0]["media"].startswith("file-") for _, body in albums[1:])
+    assert max(sent_at for sent_at, _ in albums[1:]) - upload_at < 1.0
+    assert query("SELECT count(*) FROM delivery_outbox") == [(0,)]
+    assert query("SELECT count(*) FROM sent_listings") == [(7,)]
+
+
+def test_pair_sent_concurrently_is_not_delivered_twice():
+    create_test_schema([(1, BERLIN)])
+
+    import outbox
+    import scraper_core
+    import telegram_sender
+
+    with scraper_core.ListingWriter("immoscout", notify_new=False) as writer:
+        writer.add("raced", listing())
+        writer.add("sent-before", listing())
+    query("INSERT INTO sent_listings (user_id, listing_id) VALUES (1, 'sent-before')")
+
+    # Уже отправленная пара отсекается самим INSERT
+    conn = psycopg2.connect(TEST_DSN)
+    cursor = conn.cursor()
+    assert outbox.enqueue(cursor, [(1, "sent-before")]) == 0
+    assert outbox.enqueue(cursor, [(1, "raced")]) == 1
+    conn.commit()
+
+    # Воркер доставки отправил "raced" и сбрасывает SentBuffer (те же два запроса, COMMIT ещё нет),
+    # а сопоставление в это время ставит ту же пару: INSERT ждёт блокировку и после COMMIT вставляет её
+    flusher = psycopg2.connect(TEST_DSN)
+    outbox_id = query("SELECT id FROM delivery_outbox WHERE listing_id = 'raced'")[0][0]
+    with flusher.cursor() as flush_cursor:
+        flush_cursor.execute("INSERT INTO sent_listings (user_id, listing_id) VALUES (1, 'raced')")
+        flush_cursor.execute("DELETE FROM delivery_outbox WHERE id = %s", (outbox_id,))
+
+    enqueued = []
+    thread = threading.Thread(target=lambda: (enqueued.append(outbox.enqueue(cursor, [(1, "raced")])), conn.commit()))
+    thread.start()
+    thread.join(0.5)
+    assert thread.is_alive(), "INSERT должен ждать незакоммиченное удаление"
+    flusher.commit()
+    thread.join(5)
+    flusher.close()
+    assert enqueued == [1]
+
+    # Повторная строка не уходит: при захвате она удаляется как уже отправленная
+    try:
+        telegram_sender.drain_outbox(conn)
+    finally:
+        conn.close()
+    assert query("SELECT count(*) FROM delivery_outbox") == [(0,)]
+    assert query("SELECT count(*) FROM sent_listings WHERE listing_id = 'raced'") == [(1,)]
@@ -0,0 +1,78 @@
+import csv
+
+import pytest
+
+from gazetteer import Gazetteer, build, normalize_street, split_address
+
+
+@pytest.mark.parametrize("street", [
+    "Karl-Marx-Straße", "Karl-Marx-Straße 12", "Karl Marx Str.", "karl-marx-strasse",
+    "KARL-MARX-STR. 5a", "Karl-Marx-Str 10-12",
+])
+def test_street_spellings_share_one_key(street):
+    assert normalize_street(street) == "karlmarxstr"
+
+
+def test_umlauts_and_suffixes():
+    assert normalize_street("Müllerstraße") == normalize_street("Muellerstrasse") == "muellerstr"
+    assert normalize_street("Schönhauser Allee 10") == "schoenhauserallee"
+    assert normalize_street("Rosenthaler Platz") == normalize_street("Rosenthaler Pl.") == "rosenthalerpl"
+
+
+def test_split_address():
+    assert split_address("Sonnenallee 1, 12047 Berlin") == ("sonnenallee", "12047")
+    assert split_address("Karl-Marx-Str.\xa0101, 12043 Berlin") == ("karlmarxstr", "12043")
+    assert split_address("12047 Berlin Neukölln") == ("", "12047")
+
+
+def test_build_and_lookup(tmp_path):
+    source = tmp_path / "addresses.csv"
+    with open(source, "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["street", "postcode", "lat", "lon"])
+        writer.writerow(["Karl-Marx-Straße", "12043", "52.4800", "13.4400"])
+        writer.writerow(["Karl-Marx-Straße", "12043", "52.4820", "13.4420"])
+        writer.writerow(["Sonnenallee", "12047", "52.4870", "13.4300"])
+        writer.writerow(["Nirgendwo", "99999", "0", "0"])  # не берлинский PLZ — пропускается
+    target = tmp_path / "gazetteer.csv"
+    build(source, target)
+
+    index = Gazetteer(target)
+    near = lambda point: pytest.approx(point, abs=1e-5)  # координаты хранятся во float32
+    assert index.lookup_street("karlmarxstr", "12043") == near((52.481, 13.441))
+    assert index.lookup_street(*split_address("Karl Marx Strase 5, 12043 Berlin")) == near((52.481, 13.441))  # опечатка
+    assert index.lookup_street("karlmarxstr", "12047") is None  # улица в другом PLZ не ищется
+    assert index.lookup_plz("12047") == near((52.487, 13.43))
+    assert index.lookup_plz("99999") is None
+
+
+def test_cached_nominatim_miss_still_falls_back_to_plz(tmp_path, monkeypatch):
+    pytest.importorskip("psycopg2")
+    pytest.importorskip("requests")
+    import geocoding
+
+    source = tmp_path / "addresses.csv"
+    source.write_text("street,postcode,lat,lon\nSonnenallee,12047,52.4800,13.4300\n", encoding="utf-8")
+    build(source, tmp_path / "gazetteer.csv")
+    index = Gazetteer(tmp_path / "gazetteer.csv")
+
+    # Без БД и сети: кеш в таблице недоступен, Nominatim адрес не знает
+    monkeypatch.setattr(geocoding, "get_gazetteer", lambda: index)
+    monkeypatch.setattr(geocoding, "_init_db", lambda: None)
+    monkeypatch.setattr(geocoding, "_db_get", lambda key: None)
+    monkeypatch.setattr(geocoding, "_db_put", lambda *args: None)
+    monkeypatch.setattr(geocoding, "_nominatim", lambda address: (None, None))
+    monkeypatch.setattr(geocoding, "_lru", geocoding.OrderedDict())
+
+    address = "Unbekannte Gasse 3, 12047 Berlin"
+    first = geocoding.geocode_address(address)
+    assert first == pytest.approx((52.48, 13.43), abs=1e-5)
+    # Второй раз промах берётся из памяти — центроид PLZ должен остаться
+    assert geocoding.geocode_address(address) == first
+
+
+def test_missing_gazetteer_stops_startup(tmp_path):
+    from gazetteer import require_gazetteer
+
+    with pytest.raises(SystemExit, match="gazetteer.py fetch"):
+        require_gazetteer(tmp_path / "berlin_gazetteer.csv")
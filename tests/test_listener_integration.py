@@ -0,0 +1,99 @@
+import threading
+import time
+
+import pytest
+
+from conftest import TEST_DSN, create_test_schema, query, test_listing as listing
+
+psycopg2 = pytest.importorskip("psycopg2")
+pytestmark = pytest.mark.skipif(not TEST_DSN, reason="AUTOWOHNBOT_TEST_DSN не задан")
+
+IN_ZONE = (52.5200, 13.4050)   # Mitte, внутри круга пользователя 1
+OUT_OF_ZONE = (52.4000, 13.0500)  # Potsdam, вне всех зон
+WAIT_TIMEOUT = 15
+
+
+def outbox_pairs():
+    return set(query("SELECT user_id, listing_id FROM delivery_outbox"))
+
+
+def wait_for(condition):
+    deadline = time.time() + WAIT_TIMEOUT
+    while time.time() < deadline:
+        result = condition()
+        if result:
+            return result
+        time.sleep(0.2)
+    return condition()
+
+
+def listener_pids():
+    return [row[0] for row in query(
+        "SELECT pid FROM pg_stat_activity WHERE query = %s AND pid <> pg_backend_pid()",
+        ("LISTEN new_listing",))]
+
+
+@pytest.fixture(scope="module")
+def listener():
+    create_test_schema([(1, "52.52,13.405,5000"), (2, "48.137,11.575,3000")])
+
+    import scraper_core
+    import telegram_sender
+    telegram_sender.CURSOR_SAFETY_LAG = 0
+    telegram_sender.LISTEN_POLL_TIMEOUT = 0.2
+
+    # Объявление до запуска слушателя попадает в очередь только через догоняющий проход
+    with scraper_core.ListingWriter("immoscout", notify_new=False) as writer:
+        writer.add("before-start", listing(*IN_ZONE))
+
+    threading.Thread(target=telegram_sender.run_listener, daemon=True).start()
+    assert wait_for(listener_pids), "слушатель не подключился"
+    return scraper_core
+
+
+def test_notify_enqueues_exactly_notified_ids(listener):
+    assert wait_for(lambda: (1, "before-start") in outbox_pairs())
+    query("DELETE FROM delivery_outbox")
+
+    # Без NOTIFY: слушатель не должен его брать, пока нет переподключения
+    with listener.ListingWriter("immoscout", notify_new=False) as writer:
+        writer.add("silent", listing(*IN_ZONE))
+    with listener.ListingWriter("immoscout") as writer:
+        writer.add("in-zone", listing(*IN_ZONE))
+        writer.add("out-of-zone", listing(*OUT_OF_ZONE))
+
+    assert wait_for(outbox_pairs) == {(1, "in-zone")}
+    time.sleep(1)
+    assert outbox_pairs() == {(1, "in-zone")}
+
+
+def test_reconnect_catches_up_missed_notifications(listener):
+    query("DELETE FROM delivery_outbox")
+    # Уведомление об этом объявлении потеряно — забрать его может только догоняющий проход после переподключения
+    with listener.ListingWriter("immoscout", notify_new=False) as writer:
+        writer.add("while-disconnected", listing(*IN_ZONE))
+    time.sleep(1)
+    assert (1, "while-disconnected") not in outbox_pairs()
+
+    pids = listener_pids()
+    query("SELECT pg_terminate_backend(pid) FROM unnest(%s::int[]) AS pid", (pids,))
+
+    assert wait_for(lambda: (1, "while-disconnected") in outbox_pairs())
+    assert wait_for(lambda: set(listener_pids()) - set(pids)), "слушатель не переподключился"
+
+
+def test_cursor_advances_without_reconnect(listener, monkeypatch):
+    import telegram_sender
+
+    query("DELETE FROM delivery_outbox")
+    with listener.ListingWriter("immoscout", notify_new=False) as writer:
+        writer.add("between-passes", listing(*IN_ZONE))
+    pids = listener_pids()
+
+    # Плановый проход курсором: объявление без уведомления забирается, а курсор сохраняется
+    # без переподключения — перезапуск не будет догонять всё время работы
+    monkeypatch.setattr(telegram_sender, "CURSOR_PASS_INTERVAL", 0.5)
+    assert wait_for(lambda: (1, "between-passes") in outbox_pairs())
+    cursor_value = query("SELECT value FROM run_metadata WHERE key = 'listings_cursor'")[0][0]
+    assert cursor_value.endswith("|between-passes")
+    assert listener_pids() == pids
@@ -0,0 +1,28 @@
+import time
+from datetime import datetime, timezone
+
+import pytest
+
+from conftest import TEST_DSN, query, test_listing as listing
+
+psycopg2 = pytest.importorskip("psycopg2")
+pytestmark = pytest.mark.skipif(not TEST_DSN, reason="AUTOWOHNBOT_TEST_DSN не задан")
+
+import scraper_core
+
+
+def test_partial_batch_is_flushed_by_timer_with_commit_time(monkeypatch):
+    monkeypatch.setattr(scraper_core, "FLUSH_INTERVAL", 0.5)
+    with scraper_core.ListingWriter("immoscout", notify_new=False) as writer:
+        query("DELETE FROM listings WHERE id LIKE 'writer-%%'")
+        added_at = datetime.now(timezone.utc)
+        writer.add("writer-1", listing())
+        # Следующих записей нет (скрапер грузит страницу) — пачка всё равно уходит по таймеру
+        time.sleep(1.5)
+        rows = query("SELECT created_at FROM listings WHERE id = 'writer-1'")
+        assert rows, "неполная пачка не записана по таймеру"
+        assert writer.rows == {}
+
+    # created_at — момент вставки, а не add(): объявление не попадает позади курсора рассылки
+    assert (rows[0][0] - added_at).total_seconds() >= 0.4
+    query("DELETE FROM listings WHERE id LIKE 'writer-%%'")
@@ -0,0 +1,46 @@
+from datetime import datetime
+
+import pytest
+
+pytest.importorskip("psycopg2")
+
+import telegram_sender
+from telegram_sender import BERLIN_TZ, find_matches, prepare_users
+
+MITTE = (52.5200, 13.4050)
+
+
+def user(user_id, location, version=1, use_immoscout=1):
+    return (user_id, location, None, None, None, None, None, 1, 0, 0,
+            use_immoscout, 1, 1, 1, version)
+
+
+def listing(lat, lon):
+    return ("l1", "https://example.org", 900.0, 1100.0, 50.0, "Teststraße 1, 10115 Berlin",
+            lat, lon, datetime.now(BERLIN_TZ), 0, 0, 1, 0, 0, 0, "")
+
+
+def matched_ids(users, listings):
+    prepared = prepare_users(users)
+    return {(prepared[key].user_id, pos) for key, pos in find_matches(prepared, listings)}
+
+
+def test_spatial_index_is_reused_until_filters_change(monkeypatch):
+    monkeypatch.setattr(telegram_sender, "filter_cache", telegram_sender.FilterCache())
+    cache = telegram_sender.filter_cache
+    users = [user(1, "52.52,13.405,3000"), user(2, "48.137,11.575,3000"), user(3, "52.52,13.405,1000")]
+    listings = [listing(*MITTE)]
+
+    assert matched_ids(users, listings) == {(1, 0), (3, 0)}
+    index = cache.index
+
+    # Тот же набор (user_id, filters_version) в другом порядке и с другими флагами — сетка та же,
+    # а флаги берутся из свежей строки
+    users = [users[2], users[1], user(1, "52.52,13.405,3000", use_immoscout=0)]
+    assert matched_ids(users, listings) == {(3, 0)}
+    assert cache.index is index
+
+    # Новая зона поиска (filters_version растёт) — сетка пересобирается
+    users[1] = user(2, "52.52,13.405,2000", version=2)
+    assert matched_ids(users, listings) == {(2, 0), (3, 0)}
+    assert cache.index is not index
@@ -0,0 +1,24 @@
+import pytest
+
+pytest.importorskip("bs4")
+pytest.importorskip("requests")
+pytest.importorskip("psycopg2")
+
+import InBerlinwohnen
+import Kleinanzeigen
+
+
+def test_kleinanzeigen_failure_is_not_an_empty_result(monkeypatch):
+    # main.collect_scrapers отличает ошибку (алерт админу, откладывание опроса) от «нет новых» только по исключению
+    monkeypatch.setattr(Kleinanzeigen, "fetch_html", lambda url: None)
+    with pytest.raises(RuntimeError, match="HTML"):
+        Kleinanzeigen.run("https://example.org")
+
+
+def test_inberlinwohnen_failure_is_not_an_empty_result(monkeypatch):
+    def unavailable():
+        raise ConnectionError("inberlinwohnen.de недоступен")
+
+    monkeypatch.setattr(InBerlinwohnen, "fetch_inberlin_listings", unavailable)
+    with pytest.raises(ConnectionError):
+        InBerlinwohnen.run()
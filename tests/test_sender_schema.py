@@ -0,0 +1,67 @@
+import threading
+
+import pytest
+
+from conftest import TEST_DSN, create_test_schema, query
+
+psycopg2 = pytest.importorskip("psycopg2")
+pytestmark = pytest.mark.skipif(not TEST_DSN, reason="AUTOWOHNBOT_TEST_DSN не задан")
+
+import telegram_sender
+
+TRIGGER_OID = "SELECT oid FROM pg_trigger WHERE tgname = 'users_notify_changed'"
+
+
+def setup_in_threads(count):
+    # Как при старте: несколько отправителей одновременно настраивают схему, каждый со своим соединением
+    barrier = threading.Barrier(count)
+    errors = []
+
+    def setup():
+        conn = psycopg2.connect(TEST_DSN)
+        try:
+            barrier.wait()
+            telegram_sender.ensure_sender_schema(conn)
+        except Exception as e:
+            errors.append(e)
+        finally:
+            conn.close()
+
+    telegram_sender.schema_ready = False
+    threads = [threading.Thread(target=setup) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+    return errors
+
+
+def test_concurrent_cold_start_creates_schema_once():
+    create_test_schema([(1, "52.52,13.405,5000")])
+    query("DROP TRIGGER users_notify_changed ON users")
+    query("DROP FUNCTION notify_user_changed()")
+    query("ALTER TABLE users DROP COLUMN filters_version, DROP COLUMN digest_mode")
+
+    assert setup_in_threads(4) == []
+    assert len(query(TRIGGER_OID)) == 1
+    assert query("""
+        SELECT count(*) FROM information_schema.columns
+        WHERE table_name = 'users' AND column_name IN ('filters_version', 'digest_mode')
+    """) == [(2,)]
+
+
+def test_restart_does_not_lock_users_or_recreate_trigger():
+    create_test_schema([(1, "52.52,13.405,5000")])
+    trigger_oid = query(TRIGGER_OID)
+
+    # Бот держит открытую транзакцию с чтением users: DDL на users ждал бы её завершения
+    bot = psycopg2.connect(TEST_DSN)
+    try:
+        bot.cursor().execute("SELECT count(*) FROM users")
+        done = threading.Event()
+        telegram_sender.schema_ready = False
+        threading.Thread(target=lambda: (setup_in_threads(1), done.set()), daemon=True).start()
+        assert done.wait(3), "настройка схемы ждёт блокировку users"
+    finally:
+        bot.close()
+    assert query(TRIGGER_OID) == trigger_oid
@@ -0,0 +1,48 @@
+import os
+import subprocess
+import sys
+from multiprocessing import resource_tracker, shared_memory
+
+import pytest
+
+pytest.importorskip("numpy")
+pytest.importorskip("psycopg2")
+
+import user_table
+from user_table import UserTablePublisher, UserTableReader
+
+PREFIX = "autowohnbot_test_users"
+pytestmark = pytest.mark.skipif(not os.path.isdir(user_table.SHM_DIR), reason="нет /dev/shm")
+
+
+def leave_segment(name):
+    # Сегмент, брошенный «упавшим» координатором: не закрыт через unlink и не отслеживается
+    segment = shared_memory.SharedMemory(name=name, create=True, size=8)
+    resource_tracker.unregister(segment._name, "shared_memory")
+    segment.close()
+
+
+def segments():
+    return {name for name in os.listdir(user_table.SHM_DIR) if name.startswith(PREFIX)}
+
+
+def test_publisher_starts_over_stale_segments():
+    dead = subprocess.Popen([sys.executable, "-c", "pass"])
+    dead.wait()
+    stale = [f"{PREFIX}_{dead.pid}_ctl", f"{PREFIX}_{dead.pid}_1",
+             f"{PREFIX}_{os.getpid()}_1",  # тот же pid у прошлого запуска (pid 1 в контейнере)
+             f"{PREFIX}_ctl", f"{PREFIX}_2"]  # формат без pid
+    for name in stale:
+        leave_segment(name)
+
+    publisher = UserTablePublisher(PREFIX)
+    try:
+        assert not segments() & set(stale)
+        publisher.publish()
+        publisher.publish()
+        assert publisher.generation == 2
+        assert segments() == {f"{publisher.prefix}_ctl", f"{publisher.prefix}_2"}
+        assert UserTableReader(publisher.prefix).snapshot() is not None
+    finally:
+        publisher.close()
+    assert not segments()
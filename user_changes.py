@@ -0,0 +1,105 @@
+import time
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+import psycopg2
+
+from config import DB_CONFIG
+
+BERLIN_TZ = ZoneInfo("Europe/Berlin")
+
+# Триггер на users шлёт NOTIFY с id пользователя при изменении полей, от которых зависит рассылка
+# (save_user_filters, старт/стоп поиска, оплата, истечение подписки). Долгоживущий отправитель
+# загружает пользователей один раз и дальше перечитывает только изменившиеся строки.
+USER_CHANNEL = "user_changed"
+FULL_RELOAD_INTERVAL = 600  # сек: полная перезагрузка на случай пропущенных уведомлений
+
+WATCHED_COLUMNS = (
+    "location", "min_price", "max_price", "min_size", "max_size", "subscribed_until", "is_searching",
+    "tauschwohnung", "wbs", "use_immoscout", "use_kleinanzeigen", "use_immowelt", "use_inberlinwohnen",
+    "filters_version",
+)
+
+
+NOTIFY_FUNCTION_BODY = f"""
+BEGIN
+    PERFORM pg_notify('{USER_CHANNEL}', COALESCE(NEW.id, OLD.id)::text);
+    RETURN NULL;
+END;
+"""
+
+
+def ensure_user_change_trigger(cursor):
+    # Только то, чего нет: DROP/CREATE TRIGGER берёт эксклюзивную блокировку users и мешал бы боту
+    # при каждом старте отправителя. Функция заменяется, лишь если изменился её текст;
+    # при изменении WATCHED_COLUMNS триггер нужно один раз удалить вручную — он создастся заново
+    cursor.execute("SELECT prosrc FROM pg_proc WHERE proname = 'notify_user_changed'")
+    row = cursor.fetchone()
+    if row is None or row[0] != NOTIFY_FUNCTION_BODY:
+        cursor.execute(f"""
+            CREATE OR REPLACE FUNCTION notify_user_changed() RETURNS trigger AS $${NOTIFY_FUNCTION_BODY}$$
+            LANGUAGE plpgsql
+        """)
+    cursor.execute("""
+        SELECT 1 FROM pg_trigger WHERE tgname = 'users_notify_changed' AND tgrelid = 'users'::regclass
+    """)
+    if cursor.fetchone() is None:
+        cursor.execute(f"""
+            CREATE TRIGGER users_notify_changed
+            AFTER INSERT OR DELETE OR UPDATE OF {", ".join(WATCHED_COLUMNS)} ON users
+            FOR EACH ROW EXECUTE FUNCTION notify_user_changed()
+        """)
+
+
+class LiveUsers:
+    # fetch(cursor, shard, user_ids) — telegram_sender.fetch_users: отдаёт только активных
+    # пользователей с действующей подпиской, поэтому отсутствие строки в ответе = удалить из снимка
+    def __init__(self, fetch, shard=None):
+        self.fetch = fetch
+        self.shard = shard
+        self.rows = {}
+        self.listen_conn = None
+        self.loaded_at = 0.0
+
+    def _reload(self, cursor):
+        # LISTEN до полной выборки: изменения, пришедшие во время загрузки, не теряются
+        if self.listen_conn is None or self.listen_conn.closed:
+            self.listen_conn = psycopg2.connect(**DB_CONFIG)
+            self.listen_conn.autocommit = True
+            self.listen_conn.cursor().execute(f"LISTEN {USER_CHANNEL}")
+        self.listen_conn.notifies.clear()
+        self.rows = {user[0]: user for user in self.fetch(cursor, self.shard)}
+        self.loaded_at = time.time()
+        print(f"[USERS] Загружено пользователей: {len(self.rows)}")
+
+    def _apply_changes(self, cursor):
+        self.listen_conn.poll()
+        changed = {int(n.payload) for n in self.listen_conn.notifies}
+        self.listen_conn.notifies.clear()
+        if self.shard:
+            changed = {user_id for user_id in changed if abs(user_id) % self.shard[1] == self.shard[0]}
+        if not changed:
+            return
+        for user_id in changed:
+            self.rows.pop(user_id, None)
+        for user in self.fetch(cursor, self.shard, changed):
+            self.rows[user[0]] = user
+        print(f"[USERS] Обновлено пользователей: {len(changed)}")
+
+    def users(self, cursor):
+        try:
+            if self.listen_conn is None or time.time() - self.loaded_at >= FULL_RELOAD_INTERVAL:
+                self._reload(cursor)
+            else:
+                self._apply_changes(cursor)
+        except psycopg2.Error as e:
+            # Соединение LISTEN потеряно — уведомления могли пропасть, следующий вызов загрузит всё заново
+            print(f"[USERS ERROR] {e}")
+            if self.listen_conn is not None:
+                self.listen_conn.close()
+            self.listen_conn = None
+            return self.fetch(cursor, self.shard)
+
+        # Подписка могла истечь без UPDATE — такие строки пропускаем до expire_subscriptions
+        now = datetime.now(BERLIN_TZ).replace(tzinfo=None)
+        return [user for user in self.rows.values() if user[6] is None or user[6] >= now]
@@ -0,0 +1,110 @@
+import math
+
+from spatial_index import SpatialGridIndex, circle_bbox, polygon_bbox
+
+EARTH_RADIUS = 6371000
+
+
+def parse_location(location_str):
+    if not location_str:
+        return None, None
+    if ';' in location_str:
+        points = location_str.split(';')
+        polygon = []
+        for p in points:
+            lat_str, lon_str = p.strip().split(',')
+            polygon.append((float(lat_str), float(lon_str)))
+        return ("polygon", polygon) if len(polygon) >= 3 else (None, None)
+    else:
+        parts = location_str.split(',')
+        if len(parts) == 3:
+            lat, lon, radius = map(lambda x: float(x.strip()), parts)
+            return "circle", (lat, lon, radius)
+        return None, None
+
+
+class CompiledFilter:
+    # Разобранная зона поиска пользователя с заранее посчитанными радианами, cos широты,
+    # bbox и наклонами рёбер. Арифметика та же, что в calculate_distance и
+    # point_in_polygon, поэтому результат contains() совпадает с ними до бита.
+    __slots__ = ("user", "user_id", "version", "loc_type", "loc_data", "bbox",
+                 "lat_rad", "lon_rad", "cos_lat", "radius", "edges")
+
+    def __init__(self, user, version):
+        self.user = user
+        self.user_id = user[0]
+        self.version = version
+        self.bbox = None
+        self.loc_type, self.loc_data = parse_location(user[1])
+
+        if self.loc_type == "circle":
+            lat, lon, self.radius = self.loc_data
+            self.lat_rad, self.lon_rad = math.radians(lat), math.radians(lon)
+            self.cos_lat = math.cos(self.lat_rad)
+            self.bbox = circle_bbox(lat, lon, self.radius)
+        elif self.loc_type == "polygon":
+            polygon = self.loc_data
+            self.edges = []
+            j = len(polygon) - 1
+            for i in range(len(polygon)):
+                lat_i, lon_i = polygon[i]
+                lat_j, lon_j = polygon[j]
+                slope = (lat_j - lat_i) / (lon_j - lon_i + 1e-15)
+                self.edges.append((lat_i, lon_i, lon_j, slope))
+                j = i
+            self.bbox = polygon_bbox(polygon)
+
+    def contains(self, lat, lon):
+        if self.loc_type == "circle":
+            lat2_rad, lon2_rad = math.radians(lat), math.radians(lon)
+            dlat = lat2_rad - self.lat_rad
+            dlon = lon2_rad - self.lon_rad
+            a = math.sin(dlat / 2)**2 + self.cos_lat * math.cos(lat2_rad) * math.sin(dlon / 2)**2
+            c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
+            return EARTH_RADIUS * c <= self.radius
+
+        inside = False
+        for lat_i, lon_i, lon_j, slope in self.edges:
+            if (lon_i > lon) != (lon_j > lon):
+                if lat < slope * (lon - lon_i) + lat_i:
+                    inside = not inside
+        return inside
+
+
+class FilterCache:
+    # Живёт столько же, сколько процесс отправителя. Запись пересобирается, только если
+    # изменился users.filters_version (его увеличивает telegram.save_user_filters).
+    # Сетка по bbox зон поиска (ключ — user_id) живёт здесь же и пересобирается, только когда
+    # меняется набор (user_id, filters_version): между изменениями users пакет её не трогает.
+    def __init__(self):
+        self.filters = {}
+        self.index = None
+        self.index_key = None
+
+    def get(self, user, version):
+        compiled = self.filters.get(user[0])
+        if compiled is None or compiled.version != version:
+            try:
+                compiled = CompiledFilter(user, version)
+            except ValueError as e:
+                print(f"[USER ERROR] User {user[0]}: не удалось разобрать зону поиска: {e}")
+                compiled = None
+            self.filters[user[0]] = compiled
+        elif compiled.user != user:
+            # Фильтры не менялись, но строка (подписка, флаги) могла — обновляем без разбора зоны
+            compiled.user = user
+        return compiled
+
+    def retain(self, user_ids):
+        for user_id in set(self.filters) - set(user_ids):
+            del self.filters[user_id]
+
+    def spatial_index(self, prepared):
+        # prepared — скомпилированные фильтры текущего снимка пользователей
+        key = frozenset((compiled.user_id, compiled.version) for compiled in prepared)
+        if key != self.index_key:
+            index = SpatialGridIndex()
+            for compiled in prepared:
+                index.add(compiled.user_id, compiled.bbox)
+            self.index, self.index_key = index, key
+        return self.index
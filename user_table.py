@@ -0,0 +1,302 @@
+import os
+import re
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from telegram_sender import fetch_users
+from user_changes import LiveUsers
+from user_filters import CompiledFilter
+from vector_match import LOC_CIRCLE, LOC_POLYGON, UserArrays, match_user_arrays, source_mask
+
+# Общая таблица фильтров пользователей в shared memory: координатор шардов (sender_shards)
+# публикует её, процессы рассылки подключаются без копирования и не читают users из БД.
+# Каждая публикация — новый сегмент "<prefix>_<pid>_<поколение>"; номер текущего поколения
+# лежит в маленьком сегменте "<prefix>_<pid>_ctl". Старый сегмент удаляется сразу: у уже
+# подключённых процессов отображение остаётся до их перехода на новое поколение.
+# pid координатора в имени разводит запуски, а сегменты упавших координаторов удаляются при старте.
+TABLE_PREFIX = "autowohnbot_users"
+SHM_DIR = "/dev/shm"  # Linux: здесь видны все сегменты shared memory
+REFRESH_INTERVAL = 1  # сек между проверками уведомлений об изменениях в users
+
+# (колонка, тип, ширина) — по строке на пользователя; затем вершины всех многоугольников подряд
+USER_COLUMNS = [
+    ("user_id", np.int64, 1),
+    ("version", np.int64, 1),
+    ("min_price", np.float64, 1),
+    ("max_price", np.float64, 1),
+    ("min_size", np.float64, 1),
+    ("max_size", np.float64, 1),
+    ("no_swap", np.bool_, 1),
+    ("no_wbs", np.bool_, 1),
+    ("sources", np.uint8, 1),
+    ("loc_type", np.int8, 1),
+    ("circle_lat", np.float64, 1),
+    ("circle_lon", np.float64, 1),
+    ("circle_radius", np.float64, 1),
+    ("bbox", np.float64, 4),  # min_lat, min_lon, max_lat, max_lon
+    ("vertex_start", np.int64, 1),
+    ("vertex_count", np.int64, 1),
+]
+VERTEX_COLUMNS = [("vertex_lat", np.float64, 1), ("vertex_lon", np.float64, 1)]
+HEADER_SIZE = 16  # int64: число пользователей, число вершин
+
+
+def _layout(user_count, vertex_count):
+    # Смещения колонок в сегменте, каждая выровнена по 8 байт
+    offset = HEADER_SIZE
+    layout = []
+    for columns, rows in ((USER_COLUMNS, user_count), (VERTEX_COLUMNS, vertex_count)):
+        for name, dtype, width in columns:
+            shape = (rows, width) if width > 1 else (rows,)
+            layout.append((name, dtype, shape, offset))
+            offset += -(-np.dtype(dtype).itemsize * rows * width // 8) * 8
+    return layout, offset
+
+
+def _map_columns(buf):
+    user_count, vertex_count = np.ndarray((2,), np.int64, buf)
+    layout, _ = _layout(int(user_count), int(vertex_count))
+    return {name: np.ndarray(shape, dtype, buf, offset) for name, dtype, shape, offset in layout}
+
+
+def _fill(buf, rows, vertices, vertex_total):
+    np.ndarray((2,), np.int64, buf)[:] = (len(rows), vertex_total)
+    columns = _map_columns(buf)
+
+    counts = np.array([len(v) for v in vertices], dtype=np.int64)
+    columns["vertex_count"][:] = counts
+    columns["vertex_start"][:] = np.cumsum(counts) - counts
+    if vertex_total:
+        flat = np.array([point for polygon in vertices for point in polygon], dtype=np.float64)
+        columns["vertex_lat"][:] = flat[:, 0]
+        columns["vertex_lon"][:] = flat[:, 1]
+    if not rows:
+        return  # пустая таблица: пользователей с зоной поиска пока нет
+    for name, _, _ in USER_COLUMNS:
+        if name not in ("vertex_start", "vertex_count"):
+            columns[name][:] = [row.get(name, 0.0) for row in rows]
+
+
+def _attach(name):
+    # Читатели — дочерние процессы координатора (spawn): resource_tracker у них общий с ним,
+    # поэтому выход шарда сегмент не удаляет, удалением управляет только публикующая сторона
+    return shared_memory.SharedMemory(name=name)
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def unlink_stale_segments(prefix=TABLE_PREFIX):
+    # Остатки упавших координаторов: сегменты с мёртвым pid, со своим pid (pid переиспользован,
+    # например pid 1 в контейнере) и старого формата без pid. Без SHM_DIR (не Linux) — ничего
+    if not os.path.isdir(SHM_DIR):
+        return 0
+    pattern = re.compile(rf"{re.escape(prefix)}_(?:(\d+)_)?(ctl|\d+)")
+    removed = 0
+    for name in os.listdir(SHM_DIR):
+        match = pattern.fullmatch(name)
+        if match is None:
+            continue
+        pid = match.group(1) and int(match.group(1))
+        if pid and pid != os.getpid() and _pid_alive(pid):
+            continue
+        try:
+            os.unlink(os.path.join(SHM_DIR, name))
+            removed += 1
+        except FileNotFoundError:
+            pass
+    if removed:
+        print(f"[USER TABLE] Удалено оставшихся сегментов: {removed}")
+    return removed
+
+
+def encode_user(user, version):
+    # Строка таблицы и вершины многоугольника; None — зона поиска не задана или не разбирается
+    try:
+        compiled = CompiledFilter(user, version)
+    except ValueError as e:
+        print(f"[USER ERROR] User {user[0]}: не удалось разобрать зону поиска: {e}")
+        return None
+    if compiled.loc_type is None:
+        return None
+
+    bound = lambda value, default: default if value is None else float(value)
+    row = {
+        "user_id": user[0],
+        "version": version,
+        "min_price": bound(user[2], -np.inf),
+        "max_price": bound(user[3], np.inf),
+        "min_size": bound(user[4], -np.inf),
+        "max_size": bound(user[5], np.inf),
+        "no_swap": user[8] == 0,
+        "no_wbs": user[9] == 0,
+        "sources": source_mask(user[10:14]),
+        "bbox": compiled.bbox,
+    }
+    vertices = []
+    if compiled.loc_type == "circle":
+        row["loc_type"] = LOC_CIRCLE
+        row["circle_lat"], row["circle_lon"], row["circle_radius"] = compiled.loc_data
+    else:
+        row["loc_type"] = LOC_POLYGON
+        vertices = compiled.loc_data
+    return row, vertices
+
+
+class UserTablePublisher:
+    def __init__(self, prefix=TABLE_PREFIX):
+        unlink_stale_segments(prefix)
+        self.prefix = f"{prefix}_{os.getpid()}"
+        self.encoded = {}   # user_id → (строка, вершины)
+        self.source_rows = {}  # user_id → строка users, по которой закодирован пользователь
+        self.live_users = LiveUsers(fetch_users)
+        self.generation = 0
+        self.segment = None
+        self.control = shared_memory.SharedMemory(name=f"{self.prefix}_ctl", create=True, size=8)
+        np.ndarray((1,), np.int64, self.control.buf)[0] = 0
+
+    def refresh(self, conn):
+        # Строки приходят из живого снимка (user_changes.LiveUsers): БД читается только
+        # при изменениях в users, перекодируются лишь пользователи с новой версией фильтров
+        cursor = conn.cursor()
+        current = {user[0]: user for user in self.live_users.users(cursor)}
+        conn.commit()
+        changed = [user for user_id, user in current.items() if self.source_rows.get(user_id) != user]
+        removed = self.source_rows.keys() - current.keys()
+        if not changed and not removed and self.segment is not None:
+            return False
+
+        for user_id in removed:
+            del self.source_rows[user_id]
+            self.encoded.pop(user_id, None)
+        for user in changed:
+            self.source_rows[user[0]] = user
+            encoded = encode_user(user, user[14])
+            if encoded is None:
+                self.encoded.pop(user[0], None)
+            else:
+                self.encoded[user[0]] = encoded
+        self.publish()
+        print(f"[USER TABLE] Поколение {self.generation}: {len(self.encoded)} польз., "
+              f"обновлено {len(changed)}, удалено {len(removed)}")
+        return True
+
+    def publish(self):
+        rows = [row for row, _ in self.encoded.values()]
+        vertices = [vertices for _, vertices in self.encoded.values()]
+        vertex_total = sum(len(v) for v in vertices)
+        layout, size = _layout(len(rows), vertex_total)
+
+        generation = self.generation + 1
+        segment = shared_memory.SharedMemory(name=f"{self.prefix}_{generation}", create=True, size=size)
+        try:
+            _fill(segment.buf, rows, vertices, vertex_total)
+        except Exception:
+            # Недописанный сегмент не должен занять имя следующей публикации
+            segment.unlink()
+            raise
+
+        np.ndarray((1,), np.int64, self.control.buf)[0] = generation
+        if self.segment is not None:
+            self.segment.close()
+            self.segment.unlink()
+        self.segment = segment
+        self.generation = generation
+
+    def run(self):
+        import psycopg2
+        from config import DB_CONFIG
+
+        conn = None
+        while True:
+            try:
+                if conn is None or conn.closed:
+                    conn = psycopg2.connect(**DB_CONFIG)
+                self.refresh(conn)
+            except Exception as e:
+                print(f"[USER TABLE ERROR] {e}")
+                if conn is not None:
+                    conn.close()
+                conn = None
+            time.sleep(REFRESH_INTERVAL)
+
+    def close(self):
+        for segment in (self.segment, self.control):
+            if segment is not None:
+                segment.close()
+                segment.unlink()
+
+
+class UserSnapshot:
+    # Пользователи одного шарда из текущего поколения таблицы
+    def __init__(self, columns, shard):
+        rows = np.arange(len(columns["user_id"]))
+        if shard:
+            rows = rows[np.abs(columns["user_id"]) % shard[1] == shard[0]]
+        self.user_ids = columns["user_id"][rows]
+        self.users = UserArrays.from_table(columns, rows)
+        bbox = columns["bbox"][rows]
+        # Общий bbox шарда: объявления вне него не проверяются вовсе
+        self.bounds = (bbox[:, 0].min(), bbox[:, 1].min(), bbox[:, 2].max(), bbox[:, 3].max()) if len(rows) else None
+
+    def __len__(self):
+        return len(self.user_ids)
+
+    def match(self, listings):
+        # (user_id, позиция объявления)
+        if self.bounds is None:
+            return
+        min_lat, min_lon, max_lat, max_lon = self.bounds
+        positions = [pos for pos, listing in enumerate(listings)
+                     if listing[6] is not None and listing[7] is not None
+                     and min_lat <= listing[6] <= max_lat and min_lon <= listing[7] <= max_lon]
+        if not positions:
+            return
+        matrix = match_user_arrays(self.users, [listings[pos] for pos in positions])
+        for column, row in zip(*np.nonzero(matrix.T)):
+            yield int(self.user_ids[row]), positions[column]
+
+
+class UserTableReader:
+    def __init__(self, prefix=TABLE_PREFIX):
+        self.prefix = prefix
+        self.control = None
+        self.segment = None
+        self.generation = None
+        self.snapshots = {}
+
+    def snapshot(self, shard=None):
+        # None — таблица ещё не опубликована, вызывающий читает users из БД как обычно
+        if self.control is None:
+            try:
+                self.control = _attach(f"{self.prefix}_ctl")
+            except FileNotFoundError:
+                return None
+        generation = int(np.ndarray((1,), np.int64, self.control.buf)[0])
+        if generation == 0:
+            return None
+        if generation != self.generation:
+            try:
+                segment = _attach(f"{self.prefix}_{generation}")
+            except FileNotFoundError:
+                # Поколение успели заменить — работаем с прежним до следующего пакета
+                if self.segment is None:
+                    raise
+            else:
+                # Снимки — копии строк шарда, ссылок на старый буфер не держат
+                self.snapshots = {shard: UserSnapshot(_map_columns(segment.buf), shard)}
+                if self.segment is not None:
+                    self.segment.close()
+                self.segment, self.generation = segment, generation
+        if shard not in self.snapshots:
+            self.snapshots[shard] = UserSnapshot(_map_columns(self.segment.buf), shard)
+        return self.snapshots[shard]
@@ -0,0 +1,254 @@
+import random
+import time
+
+import numpy as np
+
+import telegram_sender
+from telegram_sender import calculate_distance, matches_filters, point_in_polygon
+from user_filters import CompiledFilter
+
+EARTH_RADIUS = 6371000
+LISTING_CHUNK = 256      # столбцов матрицы за раз — ограничивает память на 10k+ пользователей
+BOUNDARY_TOLERANCE = 1e-3  # м: пары у самой границы круга перепроверяются скалярно
+
+LOC_CIRCLE = 1
+LOC_POLYGON = 2
+
+
+def _bounds(values, default):
+    return np.array([default if v is None else float(v) for v in values], dtype=np.float64)
+
+
+def source_mask(flags):
+    # Порядок битов: immoscout, kleinanzeigen, immowelt, inberlinwohnen
+    return sum(1 << bit for bit, flag in enumerate(flags) if flag)
+
+
+class UserArrays:
+    # Колонки фильтров пользователей; строка i соответствует prepared[i]
+    def __init__(self, prepared):
+        users = [compiled.user for compiled in prepared]
+        self.size = len(users)
+        self.min_price = _bounds([u[2] for u in users], -np.inf)
+        self.max_price = _bounds([u[3] for u in users], np.inf)
+        self.min_size = _bounds([u[4] for u in users], -np.inf)
+        self.max_size = _bounds([u[5] for u in users], np.inf)
+        self.no_swap = np.array([u[8] == 0 for u in users], dtype=bool)
+        self.no_wbs = np.array([u[9] == 0 for u in users], dtype=bool)
+        self.sources = np.array([source_mask(u[10:14]) for u in users], dtype=np.uint8)
+
+        circles = [(i, f.loc_data) for i, f in enumerate(prepared) if f.loc_type == "circle"]
+        self.circle_rows = np.array([i for i, _ in circles], dtype=np.intp)
+        self.circle_lat = np.radians(np.array([d[0] for _, d in circles], dtype=np.float64))
+        self.circle_lon = np.radians(np.array([d[1] for _, d in circles], dtype=np.float64))
+        self.circle_radius = np.array([d[2] for _, d in circles], dtype=np.float64)
+        self.circle_lat_deg = np.array([d[0] for _, d in circles], dtype=np.float64)
+        self.circle_lon_deg = np.array([d[1] for _, d in circles], dtype=np.float64)
+
+        # Рёбра всех многоугольников подряд; edge_starts — начало рёбер каждого многоугольника
+        polygons = [(i, f.loc_data) for i, f in enumerate(prepared) if f.loc_type == "polygon"]
+        self.polygon_rows = np.array([i for i, _ in polygons], dtype=np.intp)
+        lat_i, lon_i, lat_j, lon_j, starts = [], [], [], [], []
+        for _, polygon in polygons:
+            starts.append(len(lat_i))
+            n = len(polygon)
+            for k in range(n):
+                lat_i.append(polygon[k][0])
+                lon_i.append(polygon[k][1])
+                lat_j.append(polygon[k - 1][0])
+                lon_j.append(polygon[k - 1][1])
+        self.edge_starts = np.array(starts, dtype=np.intp)
+        self.edge_lat_i = np.array(lat_i, dtype=np.float64)
+        self.edge_lon_i = np.array(lon_i, dtype=np.float64)
+        self.edge_lon_j = np.array(lon_j, dtype=np.float64)
+        # Те же операции, что в point_in_polygon, — результат совпадает до бита
+        self.edge_slope = (np.array(lat_j, dtype=np.float64) - self.edge_lat_i) / (
+            self.edge_lon_j - self.edge_lon_i + 1e-15
+        )
+
+    @classmethod
+    def from_table(cls, columns, rows):
+        # Те же колонки из общей таблицы фильтров (user_table); rows — строки этого процесса
+        users = cls.__new__(cls)
+        users.size = len(rows)
+        for name in ("min_price", "max_price", "min_size", "max_size", "no_swap", "no_wbs", "sources"):
+            setattr(users, name, columns[name][rows])
+
+        loc_type = columns["loc_type"][rows]
+        circle = rows[loc_type == LOC_CIRCLE]
+        users.circle_rows = np.flatnonzero(loc_type == LOC_CIRCLE)
+        users.circle_lat_deg = columns["circle_lat"][circle]
+        users.circle_lon_deg = columns["circle_lon"][circle]
+        users.circle_lat = np.radians(users.circle_lat_deg)
+        users.circle_lon = np.radians(users.circle_lon_deg)
+        users.circle_radius = columns["circle_radius"][circle]
+
+        # Ребро k многоугольника: вершина k и предыдущая (k - 1, для k = 0 — последняя)
+        polygon = rows[loc_type == LOC_POLYGON]
+        users.polygon_rows = np.flatnonzero(loc_type == LOC_POLYGON)
+        starts = columns["vertex_start"][polygon]
+        counts = columns["vertex_count"][polygon]
+        users.edge_starts = (np.cumsum(counts) - counts).astype(np.intp)
+        local = np.arange(counts.sum()) - np.repeat(users.edge_starts, counts)
+        first = np.repeat(starts, counts)
+        i = first + local
+        j = first + (local - 1) % np.repeat(counts, counts)
+        vertex_lat, vertex_lon = columns["vertex_lat"], columns["vertex_lon"]
+        users.edge_lat_i = vertex_lat[i]
+        users.edge_lon_i = vertex_lon[i]
+        users.edge_lon_j = vertex_lon[j]
+        users.edge_slope = (vertex_lat[j] - users.edge_lat_i) / (users.edge_lon_j - users.edge_lon_i + 1e-15)
+        return users
+
+
+class ListingArrays:
+    def __init__(self, listings):
+        valid = [None not in (l[2], l[4], l[6], l[7], l[8]) for l in listings]
+        self.valid = np.array(valid, dtype=bool)
+        self.price = np.array([l[2] if ok else np.nan for l, ok in zip(listings, valid)], dtype=np.float64)
+        self.size = np.array([l[4] if ok else np.nan for l, ok in zip(listings, valid)], dtype=np.float64)
+        self.lat = np.array([l[6] if ok else 0.0 for l, ok in zip(listings, valid)], dtype=np.float64)
+        self.lon = np.array([l[7] if ok else 0.0 for l, ok in zip(listings, valid)], dtype=np.float64)
+        self.swap = np.array([l[9] == 1 for l in listings], dtype=bool)
+        self.wbs = np.array([l[10] == 1 for l in listings], dtype=bool)
+        self.sources = np.array([source_mask(l[11:15]) for l in listings], dtype=np.uint8)
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    # Аргументы в радианах, broadcasting (пользователи × объявления)
+    dlat = lat2 - lat1
+    dlon = lon2 - lon1
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2) ** 2
+    return EARTH_RADIUS * 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+
+
+def points_in_polygons(users, lat, lon):
+    # Лучевой тест для всех многоугольников сразу: чётность пересечений по рёбрам
+    if not len(users.polygon_rows):
+        return np.zeros((0, len(lat)), dtype=bool)
+    # Объявления по строкам, рёбра по столбцам: reduceat идёт по смежной памяти
+    lon = lon[:, np.newaxis]
+    lat = lat[:, np.newaxis]
+    crosses = (users.edge_lon_i > lon) != (users.edge_lon_j > lon)
+    with np.errstate(over="ignore", invalid="ignore"):
+        intersect_lat = users.edge_slope * (lon - users.edge_lon_i) + users.edge_lat_i
+    crosses &= lat < intersect_lat
+    return np.bitwise_xor.reduceat(crosses.view(np.uint8), users.edge_starts, axis=1).view(bool).T
+
+
+def match_chunk(users, listings, start, stop):
+    sl = slice(start, stop)
+    price = listings.price[np.newaxis, sl]
+    size = listings.size[np.newaxis, sl]
+
+    # Источник объявления должен быть разрешён пользователю: listing & ~user == 0
+    result = (listings.sources[np.newaxis, sl] & ~users.sources[:, np.newaxis]) == 0
+    result &= listings.valid[np.newaxis, sl]
+    result &= ~(users.no_swap[:, np.newaxis] & listings.swap[np.newaxis, sl])
+    result &= ~(users.no_wbs[:, np.newaxis] & listings.wbs[np.newaxis, sl])
+    result &= (price >= users.min_price[:, np.newaxis]) & (price <= users.max_price[:, np.newaxis])
+    result &= (size >= users.min_size[:, np.newaxis]) & (size <= users.max_size[:, np.newaxis])
+
+    area = np.zeros_like(result)
+    lat = listings.lat[sl]
+    lon = listings.lon[sl]
+    if len(users.circle_rows):
+        distance = haversine(
+            users.circle_lat[:, np.newaxis], users.circle_lon[:, np.newaxis],
+            np.radians(lat)[np.newaxis, :], np.radians(lon)[np.newaxis, :],
+        )
+        radius = users.circle_radius[:, np.newaxis]
+        inside = distance <= radius
+        # sin/cos в NumPy могут отличаться от math на последний бит — спорные пары считаем как раньше
+        for row, col in zip(*np.nonzero(np.abs(distance - radius) <= BOUNDARY_TOLERANCE)):
+            inside[row, col] = calculate_distance(users.circle_lat_deg[row], users.circle_lon_deg[row],
+                                                  lat[col], lon[col]) <= users.circle_radius[row]
+        area[users.circle_rows] = inside
+    if len(users.polygon_rows):
+        area[users.polygon_rows] = points_in_polygons(users, lat, lon)
+    return result & area
+
+
+def match_matrix(prepared, listings):
+    return match_user_arrays(UserArrays(prepared), listings)
+
+
+def match_user_arrays(users, listings):
+    columns = ListingArrays(listings)
+    matrix = np.zeros((users.size, len(listings)), dtype=bool)
+    for start in range(0, len(listings), LISTING_CHUNK):
+        stop = min(start + LISTING_CHUNK, len(listings))
+        matrix[:, start:stop] = match_chunk(users, columns, start, stop)
+    return matrix
+
+
+def match_pairs(prepared, listings):
+    # (ключ пользователя, позиция объявления) в порядке объявлений — как у индексного движка
+    matrix = match_matrix(prepared, listings)
+    for pos, key in zip(*np.nonzero(matrix.T)):
+        yield int(key), int(pos)
+
+
+def _random_dataset(user_count, listing_count, seed=42):
+    rng = random.Random(seed)
+    prepared = []
+    for user_id in range(user_count):
+        bounds = [rng.choice([None, rng.randint(300, 900)]), rng.choice([None, rng.randint(900, 2500)]),
+                  rng.choice([None, rng.randint(20, 50)]), rng.choice([None, rng.randint(50, 120)])]
+        flags = [rng.choice([0, 1, None]) for _ in range(6)]
+        lat, lon = 52.35 + rng.random() * 0.3, 13.1 + rng.random() * 0.55
+        if rng.random() < 0.5:
+            location = f"{lat}, {lon}, {rng.uniform(500, 8000)}"
+        else:
+            location = "; ".join(f"{lat + rng.uniform(-0.05, 0.05)}, {lon + rng.uniform(-0.08, 0.08)}"
+                                 for _ in range(rng.randint(3, 12)))
+        user = (user_id, location, *bounds, None, 1, *flags, 0)
+        prepared.append(CompiledFilter(user, 0))
+    listings = []
+    for listing_id in range(listing_count):
+        source = rng.randrange(4)
+        listings.append((
+            str(listing_id), "", rng.uniform(250, 3000), None, rng.uniform(15, 140), "",
+            52.33 + rng.random() * 0.34, 13.05 + rng.random() * 0.65, "now",
+            rng.choice([0, 1]), rng.choice([0, 1]), *[int(source == s) for s in range(4)], "",
+        ))
+    return prepared, listings
+
+
+def _reference_in_area(compiled, lat, lon):
+    # Исходная скалярная проверка — эталон для сравнения движков
+    if compiled.loc_type == "circle":
+        lat_u, lon_u, radius_u = compiled.loc_data
+        return calculate_distance(lat_u, lon_u, lat, lon) <= radius_u
+    return point_in_polygon(lat, lon, compiled.loc_data)
+
+
+def benchmark(user_count=10000, listing_count=1000):
+    prepared, listings = _random_dataset(user_count, listing_count)
+
+    started = time.perf_counter()
+    expected = {
+        (key, pos)
+        for key, compiled in enumerate(prepared)
+        for pos, listing in enumerate(listings)
+        if matches_filters(compiled.user, listing) and _reference_in_area(compiled, listing[6], listing[7])
+    }
+    loop_time = time.perf_counter() - started
+
+    started = time.perf_counter()
+    indexed = set(telegram_sender.find_matches(prepared, listings))
+    index_time = time.perf_counter() - started
+
+    started = time.perf_counter()
+    got = set(match_pairs(prepared, listings))
+    numpy_time = time.perf_counter() - started
+
+    print(f"{user_count} пользователей × {listing_count} объявлений, совпадений: {len(expected)}")
+    print(f"Python-цикл: {loop_time:.2f} сек | Сетка: {index_time:.2f} сек | NumPy: {numpy_time:.2f} сек")
+    for name, pairs in (("Сетка", indexed), ("NumPy", got)):
+        print(f"✅ {name}: результаты совпадают" if pairs == expected else
+              f"❌ {name}: расхождение в {len(pairs ^ expected)} парах")
+
+
+if __name__ == "__main__":
+    benchmark()